@@ -1,65 +1,437 @@
 # Importando bibliotecas necessárias para a aplicação.
-import tiktoken  # Biblioteca para manipulação de tokens.
 import sys  # Biblioteca padrão do Python para interagir com o sistema operacional.
-import openai  # Biblioteca para interagir com a API da OpenAI.
-import requests  # Biblioteca para fazer requisições HTTP.
-from PyQt5.QtWidgets import QApplication, QWidget, QTextEdit, QVBoxLayout, QPushButton, QHBoxLayout, QLabel, QLineEdit
+from PyQt5.QtWidgets import (QApplication, QWidget, QTextEdit, QVBoxLayout, QPushButton, QHBoxLayout, QLabel, QLineEdit,
+                             QListView, QStyledItemDelegate, QStyle, QAbstractItemView, QShortcut)
 # Importa componentes gráficos do PyQt5 para construir a interface do usuário.
-from PyQt5.QtGui import QFont, QTextCursor, QTextBlockFormat
+from PyQt5.QtGui import QFont, QTextDocument, QTextCursor, QTextCharFormat, QTextOption, QAbstractTextDocumentLayout, QPalette, QKeySequence
 # Importa funcionalidades gráficas adicionais do PyQt5.
-from PyQt5.QtCore import QTimer, Qt, QThread, pyqtSignal
-import os  # Biblioteca para interagir com o sistema de arquivos.
-from dotenv import load_dotenv  # Biblioteca para carregar variáveis de ambiente de um arquivo .env.
-
-# Configuração do tokenizador para modelo GPT-4.
-nome_modelo = "gpt-4"  # Nome do modelo GPT-4.
-tokenizador = tiktoken.encoding_for_model("gpt-4")  # Inicializa o tokenizador para o modelo GPT-4.
-
-# Carregando a chave API do arquivo .env para autenticar requisições à API da OpenAI.
-load_dotenv()  # Carrega as variáveis de ambiente do arquivo .env.
-openai.api_key = os.getenv('API_KEY')  # Define a chave da API a partir da variável de ambiente.
+from PyQt5.QtCore import QTimer, Qt, QThread, QObject, pyqtSignal, QAbstractListModel, QModelIndex, QPersistentModelIndex, QPoint, QSize
+import threading  # Biblioteca para sincronizar o contador de tokens em segundo plano.
+import html  # Biblioteca para escapar o texto das mensagens ainda não formatadas.
+import time  # Biblioteca para limitar o tempo gasto em cada quadro ao aplicar as mensagens formatadas.
+from collections import deque, OrderedDict  # Fila das requisições e cache de mensagens desenhadas.
+from nucleo import (  # Núcleo sem Qt: tokenizador, cliente HTTP, cache, contexto e requisições.
+    chave_api, max_requisicoes_simultaneas, obter_tokenizador, ClienteHTTP, CacheRespostas,
+    GerenciadorContexto, Requisicao
+)
+from armazenamento import ArmazenamentoConversas  # Conversas gravadas em disco (SQLite).
+from metricas import RegistroMetricas  # Métricas de cada requisição (tempos, tokens e custo).
+from formatacao import FormatadorMensagens  # Markdown e código das mensagens convertidos em HTML seguro.
+
+# Conta os tokens do texto digitado em um thread separado, sem travar a interface.
+# O texto é contado por linha e a contagem de cada linha fica guardada, então uma
+# edição só faz recodificar as linhas que mudaram.
+class ContadorTokens(QThread):
+    contado = pyqtSignal(int)  # Sinal emitido com a contagem de tokens do texto mais recente.
+    def __init__(self, parent=None):
+        super(ContadorTokens, self).__init__(parent)
+        self.condicao = threading.Condition()  # Acorda o thread quando há texto novo.
+        self.texto_pendente = None  # Último texto pedido e ainda não contado.
+        self.ativo = True
+        self.cache_linhas = {}  # Contagem de tokens de cada linha do texto anterior.
+
+    # Pede a contagem de um texto; pedidos anteriores ainda não atendidos são descartados.
+    def pedir(self, texto):
+        with self.condicao:
+            self.texto_pendente = texto
+            self.condicao.notify()
+
+    def parar(self):
+        with self.condicao:
+            self.ativo = False
+            self.condicao.notify()
+        self.wait()  # Aguarda o thread terminar.
+
+    def run(self):
+        while True:
+            with self.condicao:
+                while self.texto_pendente is None and self.ativo:
+                    self.condicao.wait()  # Espera um novo pedido.
+                if not self.ativo:
+                    return
+                texto, self.texto_pendente = self.texto_pendente, None
+            try:
+                total = self.contar(texto)
+            except Exception:
+                continue  # Tokenizador indisponível: o erro é mostrado pelo CarregadorTokenizador.
+            with self.condicao:
+                if self.texto_pendente is not None:
+                    continue  # O texto mudou durante a contagem: o resultado já está desatualizado.
+            self.contado.emit(total)  # Envia a contagem para a interface.
+
+    def contar(self, texto):
+        tokenizador = obter_tokenizador()  # Já carregado pelo CarregadorTokenizador na maioria das vezes.
+        cache_novo = {}  # Guarda só as linhas do texto atual, limitando o uso de memória.
+        total = 0
+        for linha in texto.splitlines(keepends=True):
+            tokens = cache_novo.get(linha)
+            if tokens is None:
+                tokens = self.cache_linhas.get(linha)  # Linha que não mudou desde a última contagem.
+                if tokens is None:
+                    tokens = len(tokenizador.encode(linha, disallowed_special=()))  # Só as linhas alteradas são codificadas.
+                cache_novo[linha] = tokens
+            total += tokens
+        self.cache_linhas = cache_novo
+        return total
+
+# Carrega os tokenizadores em segundo plano depois que a janela já está na tela.
+class CarregadorTokenizador(QThread):
+    carregado = pyqtSignal()  # Sinal emitido quando os tokenizadores estão prontos.
+    falhou = pyqtSignal(str)  # Sinal emitido com o erro quando o carregamento falha (ex.: sem rede no primeiro uso).
+    def __init__(self, modelos, parent=None):
+        super(CarregadorTokenizador, self).__init__(parent)
+        self.modelos = modelos  # Modelos cujos tokenizadores devem ser carregados.
+
+    def run(self):
+        try:
+            for modelo in self.modelos:
+                obter_tokenizador(modelo)  # Modelos com a mesma codificação reaproveitam o mesmo tokenizador.
+        except Exception as erro:  # Uma exceção dentro do QThread derrubaria o app.
+            self.falhou.emit(str(erro))
+            return
+        self.carregado.emit()
+
+# Converte as mensagens em HTML (Markdown escapado e código destacado) em um thread separado,
+# sem travar a interface. Cada mensagem tem no máximo um pedido pendente: um texto novo da mesma
+# mensagem (trecho de streaming) substitui o anterior. Os pedidos mais novos são atendidos primeiro.
+class RenderizadorMensagens(QThread):
+    renderizado = pyqtSignal(int, int, str)  # Sinal emitido com o id da mensagem, o tamanho do texto formatado e o HTML.
+    def __init__(self, parent=None):
+        super(RenderizadorMensagens, self).__init__(parent)
+        self.condicao = threading.Condition()  # Acorda o thread quando há mensagem nova.
+        self.pendentes = OrderedDict()  # (texto, cachear) de cada mensagem ainda não formatada, na ordem dos pedidos.
+        self.ativo = True
+        self.formatador = FormatadorMensagens()  # Formata e guarda o HTML de cada texto (LRU).
+
+    # Com cachear=False (resposta ainda em streaming), o HTML não entra no cache do formatador.
+    def pedir(self, id_mensagem, texto, cachear=True):
+        with self.condicao:
+            self.pendentes.pop(id_mensagem, None)
+            self.pendentes[id_mensagem] = (texto, cachear)  # O pedido vai para o fim, como o mais novo.
+            self.condicao.notify()
+
+    # Descarta os pedidos pendentes (ex.: transcrição limpa).
+    def descartar(self):
+        with self.condicao:
+            self.pendentes.clear()
+
+    def parar(self):
+        with self.condicao:
+            self.ativo = False
+            self.condicao.notify()
+        self.wait()  # Aguarda o thread terminar.
+
+    def run(self):
+        while True:
+            with self.condicao:
+                while not self.pendentes and self.ativo:
+                    self.condicao.wait()  # Espera um novo pedido.
+                if not self.ativo:
+                    return
+                id_mensagem, (texto, cachear) = self.pendentes.popitem(last=True)
+            try:
+                resultado = self.formatador.formatar(texto, cachear)
+            except Exception as erro:  # Uma mensagem que não pode ser formatada não derruba o app: fica como texto puro.
+                print(f"Erro ao formatar a mensagem: {erro}")
+                resultado = "<p>" + html.escape(texto).replace(chr(10), "<br>") + "</p>"
+            self.renderizado.emit(id_mensagem, len(texto), resultado)  # Envia o HTML para a interface.
 
 # Classe Worker para gerenciar solicitações assíncronas usando threads.
+# Modelo, temperatura e mensagens são copiados na criação, então mudanças na janela
+# enquanto a requisição espera na fila não afetam o que é enviado.
 class Worker(QThread):  # Define uma classe que herda de QThread.
-    terminado = pyqtSignal(str, dict, int)  # Sinal emitido quando a tarefa é concluída.
-    def __init__(self, app_chat, mensagem):
+    terminado = pyqtSignal(int, str, dict, int)  # Sinal emitido quando a tarefa é concluída (turno, mensagem, resposta, tokens).
+    parcial = pyqtSignal(int, str, str)  # Sinal emitido a cada trecho recebido no modo streaming (turno, mensagem, trecho).
+    def __init__(self, app_chat, turno, mensagem, mensagens, tokens_prompt, max_tokens):
         super(Worker, self).__init__()  # Inicializa a classe base.
-        self.app_chat = app_chat  # Referência à instância da aplicação de chat.
+        self.turno = turno  # Posição desta pergunta na conversa.
         self.mensagem = mensagem  # Mensagem a ser enviada à API.
+        self.requisicao = Requisicao(  # Requisição sem Qt, que faz o trabalho de fato.
+            app_chat.cliente_http, app_chat.cache, app_chat.modelo, mensagens, app_chat.temperatura,
+            max_tokens, tokens_prompt, streaming=app_chat.modo_streaming, ao_receber_trecho=self.emitir_parcial,
+            metricas=app_chat.metricas)  # Criada ao entrar na fila: a espera por uma vaga também é medida.
+
+    # Cancela a requisição; se a resposta já estiver chegando, fecha o socket para interromper a leitura.
+    def cancelar(self):
+        self.requisicao.cancelar()
 
     # Executa a solicitação à API da OpenAI e emite o sinal quando completa.
     def run(self):  # Método que é executado quando o thread inicia.
-        resposta, contagem_tokens = self.enviar_solicitacao_openai()  # Envia a solicitação à API.
+        resposta, contagem_tokens = None, 0
+        if not self.requisicao.cancelado:
+            resposta, contagem_tokens = self.enviar_solicitacao_openai()  # Envia a solicitação à API.
+        if self.requisicao.cancelado:
+            resposta, contagem_tokens = {"cancelado": True}, 0  # Descarta o que chegou depois do cancelamento.
         if resposta is None:
             resposta = {}  # Garante que a resposta seja um dicionário.
-        self.terminado.emit(self.mensagem, resposta, contagem_tokens)  # Emite o sinal com a mensagem, resposta e contagem de tokens.
+        self.terminado.emit(self.turno, self.mensagem, resposta, contagem_tokens)  # Emite o sinal com a mensagem, resposta e contagem de tokens.
 
     # Prepara e envia uma solicitação HTTP para a API da OpenAI.
     def enviar_solicitacao_openai(self):
-        link = "https://api.openai.com/v1/chat/completions"  # URL da API.
-        cabecalhos = {"Content-Type": "application/json", "Authorization": f"Bearer {openai.api_key}"}  # Cabeçalhos da requisição.
-        dados = {  # Dados da requisição.
-            "model": self.app_chat.modelo,
-            "messages": self.app_chat.historico_conversa,
-            "temperature": self.app_chat.temperatura,
-            "max_tokens": 4000
-        }
-        try:
-            resposta = requests.post(link, headers=cabecalhos, json=dados)  # Envia a requisição POST.
-            if resposta.status_code == 200:  # Verifica se a resposta é bem-sucedida.
-                resposta_json = resposta.json()  # Converte a resposta para JSON.
-                if 'choices' in resposta_json and resposta_json['choices']:  # Verifica se há respostas válidas.
-                    contagem_tokens = resposta_json.get('usage', {}).get('total_tokens', 0)  # Obtém a contagem de tokens.
-                    return resposta_json, contagem_tokens  # Retorna a resposta e a contagem de tokens.
-                else:
-                    print("Resposta da API não contém 'choices'")  # Mensagem de erro.
-                    return None, 0
-            else:
-                print(f"Erro na requisição: {resposta.status_code}")  # Mensagem de erro.
-                return None, 0
-        except Exception as e:
-            print(f"Exceção ao fazer a solicitação: {e}")  # Mensagem de erro em caso de exceção.
-            return None, 0
+        return self.requisicao.executar()
+
+    # Repassa à interface um trecho recebido em streaming.
+    def emitir_parcial(self, trecho):
+        self.parcial.emit(self.turno, self.mensagem, trecho)
+
+# Agenda os Workers: limita quantas requisições rodam ao mesmo tempo e entrega os
+# resultados na ordem dos turnos, mesmo que as respostas cheguem fora de ordem.
+# Só o turno mais antigo ainda aberto tem seus trechos repassados na hora; os trechos
+# dos outros ficam guardados até chegar a vez deles.
+class AgendadorRequisicoes(QObject):
+    concluido = pyqtSignal(str, dict, int)  # Resultado de um turno, em ordem (mensagem, resposta, tokens).
+    parcial = pyqtSignal(str, str)  # Trecho do turno atual, em ordem (mensagem, trecho).
+
+    def __init__(self, max_simultaneas=max_requisicoes_simultaneas, parent=None):
+        super(AgendadorRequisicoes, self).__init__(parent)
+        self.max_simultaneas = max_simultaneas  # Quantidade máxima de requisições ao mesmo tempo.
+        self.proximo_id = 0  # Número do próximo turno criado.
+        self.proximo_turno = 0  # Próximo turno a ser entregue à interface.
+        self.fila = deque()  # Workers esperando uma vaga.
+        self.ativos = {}  # Workers rodando, por turno.
+        self.prontos = {}  # Resultados que chegaram antes dos turnos anteriores.
+        self.trechos = {}  # Trechos guardados dos turnos que ainda não são o atual.
+        self.mensagens = {}  # Mensagem de cada turno ainda não entregue.
+
+    def novo_turno(self):
+        turno = self.proximo_id
+        self.proximo_id += 1
+        return turno
+
+    def pendentes(self):
+        return self.proximo_id - self.proximo_turno  # Turnos ainda não entregues.
+
+    def enviar(self, trabalhador):
+        self.mensagens[trabalhador.turno] = trabalhador.mensagem
+        trabalhador.terminado.connect(self.receber_resultado)  # Conecta o sinal terminado ao método receber_resultado.
+        trabalhador.parcial.connect(self.receber_parcial)  # Conecta o sinal parcial ao método receber_parcial.
+        trabalhador.finished.connect(self.liberar)  # Libera a vaga quando o thread termina.
+        self.fila.append(trabalhador)
+        self.iniciar_proximos()
+
+    def iniciar_proximos(self):
+        while self.fila and len(self.ativos) < self.max_simultaneas:
+            trabalhador = self.fila.popleft()
+            self.ativos[trabalhador.turno] = trabalhador
+            trabalhador.start()  # Inicia o thread.
+
+    def liberar(self):
+        trabalhador = self.sender()  # Worker cujo thread terminou.
+        self.ativos.pop(trabalhador.turno, None)
+        trabalhador.deleteLater()
+        self.iniciar_proximos()
+
+    def receber_parcial(self, turno, mensagem, trecho):
+        if turno == self.proximo_turno:
+            self.parcial.emit(mensagem, trecho)  # Turno atual: repassa na hora.
+        elif turno > self.proximo_turno:
+            self.trechos.setdefault(turno, []).append(trecho)  # Guarda até chegar a vez dele.
+
+    def receber_resultado(self, turno, mensagem, resposta, contagem_tokens):
+        if turno < self.proximo_turno:
+            return  # Turno já entregue (por exemplo, cancelado).
+        self.prontos[turno] = (mensagem, resposta, contagem_tokens)
+        self.entregar()
+
+    # Entrega, em ordem, todos os turnos que já estão prontos.
+    def entregar(self):
+        while self.proximo_turno in self.prontos:
+            mensagem, resposta, contagem_tokens = self.prontos.pop(self.proximo_turno)
+            self.trechos.pop(self.proximo_turno, None)
+            self.mensagens.pop(self.proximo_turno, None)
+            self.proximo_turno += 1
+            self.concluido.emit(mensagem, resposta, contagem_tokens)
+            for trecho in self.trechos.pop(self.proximo_turno, []):  # O novo turno atual mostra o que já recebeu.
+                self.parcial.emit(self.mensagens[self.proximo_turno], trecho)
+
+    # Cancela todas as requisições na fila e em andamento.
+    def cancelar_todos(self):
+        self.fila.clear()  # Os da fila nem chegam a começar.
+        for trabalhador in list(self.ativos.values()):
+            trabalhador.cancelar()
+        for turno in range(self.proximo_turno, self.proximo_id):
+            self.prontos[turno] = (self.mensagens.get(turno, ""), {"cancelado": True}, 0)
+        self.entregar()
+
+    # Cancela tudo e espera os threads terminarem (usado ao fechar a janela).
+    def encerrar(self):
+        self.cancelar_todos()
+        for trabalhador in list(self.ativos.values()):
+            trabalhador.wait()
+
+# Modelo da transcrição: a lista de mensagens exibidas. Cada mensagem é um dicionário com
+# id, remetente, texto e alinhamento; avisos (remetente None) já vêm em HTML. O HTML formatado
+# pelo RenderizadorMensagens chega depois, em definir_html.
+class ModeloTranscricao(QAbstractListModel):
+    trechoAnexado = pyqtSignal(QModelIndex, str)  # Trecho acrescentado a uma mensagem (sem refazer a formatação dela).
+
+    def __init__(self, parent=None):
+        super(ModeloTranscricao, self).__init__(parent)
+        self.itens = []  # Mensagens exibidas, em ordem.
+        self.proximo_id = 0  # Identifica cada mensagem no cache do delegado.
+        self.por_id = {}  # Mensagem de cada id.
+        self.ordem_inicio = 0  # Ordem da primeira mensagem: a linha de cada uma é a ordem dela menos esta.
+        self.ordem_fim = 0  # Ordem da próxima mensagem acrescentada no fim.
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.itens)
+
+    def data(self, indice, papel=Qt.DisplayRole):
+        if not indice.isValid():
+            return None
+        item = self.itens[indice.row()]
+        if papel == Qt.DisplayRole:
+            return item['texto']  # Texto puro (usado ao copiar a mensagem).
+        return None
+
+    # Dicionário da mensagem, sem passar pela conversão do QVariant (usado pelo delegado a cada desenho).
+    def item(self, indice):
+        return self.itens[indice.row()]
+
+    def novo_item(self, remetente, texto, alinhamento, ordem):
+        self.proximo_id += 1
+        item = {"id": self.proximo_id, "remetente": remetente, "texto": texto, "alinhamento": alinhamento,
+                "ordem": ordem, "html": None, "tamanho_html": 0}  # HTML formatado dos primeiros tamanho_html caracteres.
+        self.por_id[item['id']] = item
+        return item
+
+    def adicionar(self, remetente, texto, alinhamento):
+        linha = len(self.itens)
+        self.beginInsertRows(QModelIndex(), linha, linha)
+        item = self.novo_item(remetente, texto, alinhamento, self.ordem_fim)
+        self.ordem_fim += 1
+        self.itens.append(item)
+        self.endInsertRows()
+        return item
+
+    # Insere várias mensagens no início de uma vez (página antiga carregada do banco).
+    def inserir_inicio(self, mensagens):
+        if not mensagens:
+            return []
+        self.beginInsertRows(QModelIndex(), 0, len(mensagens) - 1)
+        self.ordem_inicio -= len(mensagens)
+        itens = [self.novo_item(*mensagem, self.ordem_inicio + i) for i, mensagem in enumerate(mensagens)]
+        self.itens[0:0] = itens
+        self.endInsertRows()
+        return itens
+
+    # Guarda o HTML formatado de uma mensagem; ignora mensagens que já saíram da transcrição.
+    def definir_html(self, id_mensagem, tamanho, html_formatado):
+        item = self.por_id.get(id_mensagem)
+        if item is None or tamanho < item['tamanho_html'] or tamanho > len(item['texto']):
+            return  # Mensagem apagada ou resultado mais antigo que o já exibido.
+        item['html'] = html_formatado
+        item['tamanho_html'] = tamanho
+        indice = self.index(item['ordem'] - self.ordem_inicio)
+        self.dataChanged.emit(indice, indice)
+
+    # Acrescenta texto a uma mensagem (resposta em streaming), mesmo que outras tenham entrado depois dela.
+    # Emite trechoAnexado em vez de dataChanged: o documento da mensagem só é refeito quando chega o HTML novo.
+    def anexar(self, id_mensagem, trecho):
+        item = self.por_id.get(id_mensagem)
+        if item is None:
+            return  # Mensagem apagada da transcrição.
+        item['texto'] += trecho
+        self.trechoAnexado.emit(self.index(item['ordem'] - self.ordem_inicio), trecho)
+
+    def limpar(self):
+        self.beginResetModel()
+        self.itens.clear()
+        self.por_id.clear()
+        self.ordem_inicio = self.ordem_fim = 0
+        self.endResetModel()
+
+# Desenha cada mensagem da transcrição. O documento formatado de cada mensagem fica em
+# um cache LRU e a altura de todas fica guardada, então rolar a lista só desenha as
+# mensagens visíveis, sem refazer a formatação; tudo é refeito apenas quando a largura muda.
+class DelegadoMensagem(QStyledItemDelegate):
+    margem = 6  # Espaço em volta de cada mensagem.
+
+    def __init__(self, lista, max_documentos=300):
+        super(DelegadoMensagem, self).__init__(lista)
+        self.lista = lista  # Lista onde as mensagens são exibidas.
+        self.max_documentos = max_documentos  # Quantos documentos formatados ficam no cache.
+        self.documentos = OrderedDict()  # Documento formatado de cada mensagem (LRU).
+        self.alturas = {}  # Altura de cada mensagem na largura atual.
+        self.largura = -1  # Largura em que as mensagens do cache foram formatadas.
+
+    # Usa o HTML formatado pelo RenderizadorMensagens; o texto que ainda não foi formatado (mensagem
+    # nova ou trechos recentes do streaming) aparece escapado, como texto puro.
+    def html(self, item):
+        if item['remetente'] is None:
+            return item['texto']  # Aviso já formatado.
+        restante = html.escape(item['texto'][item['tamanho_html']:]).replace(chr(10), '<br>')
+        return f"<b>{html.escape(item['remetente'])}:</b><br>{item['html'] or ''}{restante}"
+
+    def largura_texto(self):
+        return max(self.lista.viewport().width() - 2 * self.margem, 50)
+
+    def documento(self, item, fonte):
+        largura = self.largura_texto()
+        if largura != self.largura:  # A lista mudou de largura: todas as mensagens precisam ser refeitas.
+            self.largura = largura
+            self.documentos.clear()
+            self.alturas.clear()
+        documento = self.documentos.get(item['id'])
+        if documento is None:
+            documento = QTextDocument()
+            documento.setDefaultFont(fonte)
+            documento.setDefaultTextOption(QTextOption(item['alinhamento']))
+            documento.setHtml(self.html(item))
+            documento.setTextWidth(largura)
+            self.documentos[item['id']] = documento
+            if len(self.documentos) > self.max_documentos:
+                self.documentos.popitem(last=False)  # Descarta o documento usado há mais tempo.
+        else:
+            self.documentos.move_to_end(item['id'])
+        self.alturas[item['id']] = int(documento.size().height())
+        return documento
+
+    # Acrescenta o trecho, como texto puro, ao fim do documento já formatado (resposta em streaming),
+    # em vez de refazer o documento inteiro a cada trecho.
+    def acrescentar(self, indice, trecho):
+        item = indice.model().item(indice)
+        documento = self.documentos.get(item['id'])
+        if documento is None:
+            if self.alturas.pop(item['id'], None) is not None:
+                self.sizeHintChanged.emit(indice)  # Fora do cache: é refeito com o texto inteiro quando for desenhado.
+            return
+        cursor = QTextCursor(documento)
+        cursor.movePosition(QTextCursor.End)
+        cursor.insertText(trecho, QTextCharFormat())  # Sem herdar o negrito ou o código do fim do HTML.
+        altura = int(documento.size().height())
+        if altura != self.alturas.get(item['id']):
+            self.alturas[item['id']] = altura
+            self.sizeHintChanged.emit(indice)  # A mensagem cresceu: a lista refaz as posições.
+        else:
+            self.lista.viewport().update(self.lista.visualRect(indice))
+
+    # Descarta o cache das mensagens alteradas (ex.: HTML novo de uma resposta em streaming).
+    def invalidar(self, inicio, fim):
+        modelo = inicio.model()
+        for linha in range(inicio.row(), fim.row() + 1):
+            item = modelo.item(modelo.index(linha))
+            self.documentos.pop(item['id'], None)
+            self.alturas.pop(item['id'], None)
+
+    def sizeHint(self, opcao, indice):
+        item = indice.model().item(indice)
+        if self.largura_texto() != self.largura or item['id'] not in self.alturas:
+            self.documento(item, opcao.font)
+        return QSize(self.largura + 2 * self.margem, self.alturas[item['id']] + 2 * self.margem)
+
+    def paint(self, pintor, opcao, indice):
+        item = indice.model().item(indice)
+        documento = self.documento(item, opcao.font)
+        pintor.save()
+        if opcao.state & QStyle.State_Selected:
+            pintor.fillRect(opcao.rect, opcao.palette.color(QPalette.Highlight).darker(200))  # Destaque discreto da mensagem selecionada.
+        pintor.translate(opcao.rect.left() + self.margem, opcao.rect.top() + self.margem)
+        pintor.setClipRect(0, 0, self.largura, opcao.rect.height() - self.margem)
+        contexto = QAbstractTextDocumentLayout.PaintContext()
+        contexto.palette.setColor(QPalette.Text, opcao.palette.color(QPalette.Text))  # Usa a cor de texto da folha de estilo.
+        documento.documentLayout().draw(pintor, contexto)
+        pintor.restore()
 
 # Classe principal para a aplicação de chat.
 class ChatApp(QWidget):  # Define uma classe que herda de QWidget.
@@ -70,7 +442,25 @@ class ChatApp(QWidget):  # Define uma classe que herda de QWidget.
         self.setGeometry(100, 100, 1280, 720)  # Define o tamanho e a posição da janela.
         self.modelo = "gpt-3.5-turbo-16k"  # Modelo inicial da API.
         self.temperatura = 0.5  # Define a criatividade padrão das respostas.
-        self.historico_conversa = []  # Armazena o histórico de mensagens para contexto.
+        self.contexto = GerenciadorContexto()  # Guarda o histórico e monta o que é enviado a cada requisição.
+        self.historico_conversa = self.contexto.mensagens  # Armazena o histórico de mensagens para contexto.
+        self.modo_streaming = True  # Recebe a resposta em partes, exibindo cada trecho assim que chega.
+        self.bloco_gpt_aberto = False  # Indica se há uma resposta em streaming sendo escrita na tela.
+        self.id_resposta_aberta = None  # Mensagem da transcrição que recebe os trechos do streaming.
+        self.cache = CacheRespostas()  # Cache local de respostas.
+        self.metricas = RegistroMetricas()  # Tempos, tokens e custo de cada requisição.
+        self.agendador = AgendadorRequisicoes(parent=self)  # Controla as requisições simultâneas e a ordem das respostas.
+        self.agendador.concluido.connect(self.atualizar_ui)  # Conecta o sinal concluido ao método atualizar_ui.
+        self.agendador.parcial.connect(self.atualizar_ui_parcial)  # Conecta o sinal parcial ao método atualizar_ui_parcial.
+        self.cliente_http = None  # Cliente HTTP único, reutilizado por todos os Workers (criado em iniciar_servicos).
+        self.tokenizador_pronto = False  # Indica se o tokenizador já foi carregado.
+        self.erro_tokenizador = None  # Erro do carregamento do tokenizador, exibido no contador.
+        self.envios_pendentes = []  # Mensagens enviadas antes de o tokenizador carregar; saem quando ele fica pronto.
+        self.carregador = None  # Thread que carrega os tokenizadores.
+        self.armazenamento = None  # Banco das conversas (aberto em iniciar_servicos).
+        self.conversa_id = None  # Conversa atual no banco.
+        self.primeira_mensagem_id = None  # Mensagem mais antiga já carregada; as anteriores vêm ao rolar para cima.
+        QTimer.singleShot(0, self.iniciar_servicos)  # Termina a inicialização depois que a janela aparece.
 
         # Configurações de widgets da UI, como botões, entradas de texto e layouts.
         self.label_status = QLabel("Aguardando resposta...", self)  # Texto exibido enquanto aguarda a resposta da API.
@@ -81,21 +471,47 @@ class ChatApp(QWidget):  # Define uma classe que herda de QWidget.
         self.entrada = QTextEdit(self)  # Área de texto para entrada do usuário.
         self.entrada.textChanged.connect(self.ajustar_altura_entrada)  # Conecta o evento de mudança de texto.
 
-        self.timer_contagem_tokens = QTimer(self)  # Timer para atualizar a contagem de caracteres.
-        self.timer_contagem_tokens.setInterval(1000)  # Define o intervalo do timer.
-        self.timer_contagem_tokens.timeout.connect(self.atualizar_contador_caracteres)  # Conecta o evento de timeout.
-        self.entrada.textChanged.connect(self.timer_contagem_tokens.start)  # Inicia o timer quando o texto muda.
-
-        self.timer_contagem_tokens = QTimer(self)  # Outro timer para atualizar a contagem de tokens.
-        self.timer_contagem_tokens.setInterval(1000)  # Define o intervalo do timer.
+        self.timer_contagem_tokens = QTimer(self)  # Timer para atualizar a contagem de caracteres e tokens.
+        self.timer_contagem_tokens.setSingleShot(True)  # Dispara uma vez só, depois que o usuário para de digitar.
+        self.timer_contagem_tokens.setInterval(300)  # Define o intervalo do timer.
         self.timer_contagem_tokens.timeout.connect(self.atualizar_contagem_tokens)  # Conecta o evento de timeout.
-        self.entrada.textChanged.connect(self.timer_contagem_tokens.start)  # Inicia o timer quando o texto muda.
+        self.entrada.textChanged.connect(self.timer_contagem_tokens.start)  # Reinicia o timer a cada mudança no texto.
+
+        self.contador = ContadorTokens(self)  # Contador de tokens em segundo plano.
+        self.contador.contado.connect(self.receber_contagem_tokens)  # Conecta o sinal contado ao método receber_contagem_tokens.
+        self.contador.start()  # Inicia o thread.
 
         self.contador_tokens = QTextEdit(self)  # Área de texto para mostrar a contagem de tokens.
         self.contador_tokens.setReadOnly(True)  # Define como somente leitura.
 
-        self.resultados = QTextEdit(self)  # Área de texto para mostrar as respostas da API.
-        self.resultados.setReadOnly(True)  # Define como somente leitura.
+        # Lista virtualizada para mostrar as respostas da API: só as mensagens visíveis são desenhadas.
+        self.transcricao = ModeloTranscricao(self)  # Mensagens exibidas.
+        self.resultados = QListView(self)
+        self.resultados.setModel(self.transcricao)
+        self.delegado_mensagens = DelegadoMensagem(self.resultados)  # Desenha e guarda em cache cada mensagem.
+        self.resultados.setItemDelegate(self.delegado_mensagens)
+        self.transcricao.dataChanged.connect(self.delegado_mensagens.invalidar)  # Refaz só a mensagem que mudou.
+        self.transcricao.trechoAnexado.connect(self.delegado_mensagens.acrescentar)  # Trechos do streaming, sem refazer.
+        self.renderizador = RenderizadorMensagens(self)  # Formata o Markdown e o código das mensagens em segundo plano.
+        self.renderizador.renderizado.connect(self.receber_renderizado)
+        self.renderizador.start()  # Inicia o thread.
+        self.renderizados = deque()  # Mensagens formatadas esperando para entrar na transcrição.
+        self.timer_renderizados = QTimer(self)  # Aplica as mensagens formatadas aos poucos, entre um quadro e outro.
+        self.timer_renderizados.setSingleShot(True)
+        self.timer_renderizados.timeout.connect(self.aplicar_renderizados)
+        self.timer_streaming = QTimer(self)  # Formata a resposta em streaming no máximo a cada intervalo.
+        self.timer_streaming.setSingleShot(True)
+        self.timer_streaming.setInterval(150)
+        self.timer_streaming.timeout.connect(self.renderizar_resposta_aberta)
+        self.resultados.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)  # Rolagem suave em mensagens longas.
+        self.resultados.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.resultados.setResizeMode(QListView.Adjust)  # Refaz a formatação quando a largura muda.
+        self.resultados.setLayoutMode(QListView.Batched)  # Calcula as alturas em lotes, sem travar a janela.
+        self.resultados.setBatchSize(200)
+        self.resultados.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.resultados.setEditTriggers(QAbstractItemView.NoEditTriggers)  # Define como somente leitura.
+        QShortcut(QKeySequence.Copy, self.resultados, self.copiar_mensagem)  # Ctrl+C copia a mensagem selecionada.
+        self.resultados.verticalScrollBar().valueChanged.connect(self.rolagem_resultados)  # Carrega mensagens antigas ao chegar no topo.
 
         # Layouts para organizar os widgets na janela.
         layout_resultados = QVBoxLayout()  # Layout vertical para os resultados.
@@ -117,9 +533,17 @@ class ChatApp(QWidget):  # Define uma classe que herda de QWidget.
         self.botao_enviar.clicked.connect(self.entrada.clear)  # Limpa a entrada após enviar.
         layout_entrada.addStretch(2)  # Adiciona espaços à direita do enviar.
 
+        self.painel_metricas = QLabel("Sem requisições", self)  # Resumo das métricas, ao lado do contador de tokens.
+        self.painel_metricas.setAlignment(Qt.AlignCenter)
+
         layout_contador = QVBoxLayout()  # Layout vertical para o contador de tokens.
         layout_contador.addStretch(1)
-        layout_contador.addWidget(self.contador_tokens, alignment=Qt.AlignCenter)
+        layout_linha_contador = QHBoxLayout()  # Contador de tokens e painel de métricas lado a lado.
+        layout_linha_contador.addStretch(1)
+        layout_linha_contador.addWidget(self.contador_tokens, alignment=Qt.AlignCenter)
+        layout_linha_contador.addWidget(self.painel_metricas, alignment=Qt.AlignCenter)
+        layout_linha_contador.addStretch(1)
+        layout_contador.addLayout(layout_linha_contador)
 
         layout_principal = QVBoxLayout(self)  # Layout principal vertical.
         layout_principal.addLayout(layout_contador)
@@ -129,6 +553,7 @@ class ChatApp(QWidget):  # Define uma classe que herda de QWidget.
 
         # Outras configurações de UI e inicializações, como botões de modelo e temperatura.
         self.tokens_mensagem = 0
+        self.tokens_prompt = 0
         self.tokens_resposta = 0
         self.contador_caracteres = 0
         self.limite_tokens_msg = 2000
@@ -157,6 +582,103 @@ class ChatApp(QWidget):  # Define uma classe que herda de QWidget.
         self.set_posicao_botao_aumentar_temp(self.botao_aumentar_temp, 100, 75)  # Define a posição do botão de aumentar temperatura.
         self.set_posicao_botao_diminuir_temp(self.botao_diminuir_temp, 5, 75)  # Define a posição do botão de diminuir temperatura.
 
+    # Inicializações pesadas, feitas depois da primeira pintura da janela.
+    def iniciar_servicos(self):
+        if self.carregador is not None:
+            return  # Serviços já iniciados.
+        self.cliente_http = ClienteHTTP(chave_api)  # Cria o cliente HTTP compartilhado.
+        self.carregador = CarregadorTokenizador(["gpt-3.5-turbo-16k", "gpt-4-0613"], self)  # Carrega os tokenizadores dos dois botões.
+        self.carregador.carregado.connect(self.tokenizador_carregado)  # Conecta o sinal carregado ao método tokenizador_carregado.
+        self.carregador.falhou.connect(self.tokenizador_falhou)  # Conecta o sinal falhou ao método tokenizador_falhou.
+        self.carregador.start()  # Inicia o thread.
+        self.abrir_conversa()  # Restaura a última conversa.
+
+    # Abre a última conversa do banco (ou cria uma nova), carregando só as mensagens mais recentes.
+    def abrir_conversa(self):
+        self.armazenamento = ArmazenamentoConversas()
+        self.conversa_id = self.armazenamento.ultima_conversa() or self.armazenamento.nova_conversa()
+        linhas = self.armazenamento.carregar_recentes(self.conversa_id)
+        for id_mensagem, papel, conteudo, tokens in linhas:
+            self.contexto.adicionar({"role": papel, "content": conteudo}, tokens)
+            remetente, alinhamento = self.formatar_remetente(papel)
+            self.adicionar_mensagem_ui(remetente, conteudo, alinhamento)
+        self.primeira_mensagem_id = linhas[0][0] if linhas else None
+
+    # Remetente e alinhamento com que cada papel aparece na tela.
+    def formatar_remetente(self, papel):
+        return ("EU", Qt.AlignRight) if papel == "user" else ("GPT", Qt.AlignLeft)
+
+    def rolagem_resultados(self, valor):
+        if valor == 0 and self.primeira_mensagem_id is not None:
+            self.carregar_mensagens_anteriores()
+
+    # Carrega do banco a página de mensagens anterior às que já estão na tela.
+    def carregar_mensagens_anteriores(self):
+        linhas = self.armazenamento.carregar_anteriores(self.conversa_id, self.primeira_mensagem_id)
+        if not linhas:
+            self.primeira_mensagem_id = None  # Chegou ao início da conversa.
+            return
+        if not self.tokenizador_pronto and any(tokens is None for _, _, _, tokens in linhas):
+            return  # Contar essas mensagens travaria a interface; a página é carregada quando o tokenizador ficar pronto.
+        self.primeira_mensagem_id = linhas[0][0]
+        self.contexto.inserir_anteriores([{"role": papel, "content": conteudo} for _, papel, conteudo, _ in linhas],
+                                         [tokens for _, _, _, tokens in linhas])
+        mensagens = []
+        for _, papel, conteudo, _ in linhas:
+            remetente, alinhamento = self.formatar_remetente(papel)
+            mensagens.append((remetente, conteudo, alinhamento))
+        for item in reversed(self.transcricao.inserir_inicio(mensagens)):  # Insere a página inteira de uma vez, no início.
+            self.renderizar(item)  # As mensagens mais perto da tela são formatadas primeiro.
+        primeira_visivel = self.transcricao.index(len(mensagens))  # Mensagem que estava no topo, depois da página inserida.
+        self.resultados.scrollTo(primeira_visivel, QAbstractItemView.PositionAtTop)  # Mantém na tela a mensagem que estava no topo.
+
+    # Copia o texto da mensagem selecionada na transcrição.
+    def copiar_mensagem(self):
+        indice = self.resultados.currentIndex()
+        if indice.isValid():
+            QApplication.clipboard().setText(indice.data(Qt.DisplayRole))
+
+    # Grava no banco as últimas mensagens do histórico, com a contagem de tokens quando já disponível.
+    def gravar_mensagens(self, quantidade):
+        if self.armazenamento is None:
+            return
+        inicio = len(self.contexto.mensagens) - quantidade
+        for i in range(inicio, len(self.contexto.mensagens)):
+            mensagem = self.contexto.mensagens[i]
+            tokens = self.contexto.tokens[i] if i < len(self.contexto.tokens) else None
+            self.armazenamento.adicionar_mensagem(self.conversa_id, mensagem['role'], mensagem['content'], tokens)
+
+    def tokenizador_carregado(self):
+        self.tokenizador_pronto = True
+        self.atualizar_contagem_tokens()  # Troca o aviso de carregamento pela contagem real.
+        envios, self.envios_pendentes = self.envios_pendentes, []
+        for mensagem in envios:
+            self.enviar_texto(mensagem)  # Envia, na ordem, as mensagens que esperavam o tokenizador.
+        if self.primeira_mensagem_id is not None and self.resultados.verticalScrollBar().value() == 0:
+            self.carregar_mensagens_anteriores()  # Página que ficou esperando o tokenizador.
+
+    def tokenizador_falhou(self, erro):
+        self.erro_tokenizador = erro
+        self.atualizar_texto_contador()  # Troca o aviso de carregamento pelo erro.
+        if self.envios_pendentes:
+            self.envios_pendentes.clear()  # Sem o tokenizador não dá para montar o prompt.
+            self.mostrar_erro_tokenizador()
+
+    def mostrar_erro_tokenizador(self):
+        self.label_status.setText(f"Não foi possível enviar: erro ao carregar o tokenizador ({self.erro_tokenizador})")
+        self.label_status.show()
+
+    def closeEvent(self, evento):
+        self.agendador.encerrar()  # Cancela as requisições em andamento.
+        self.contador.parar()  # Encerra o contador de tokens.
+        self.renderizador.parar()  # Encerra o renderizador das mensagens.
+        if self.cliente_http is not None:
+            self.cliente_http.fechar()  # Fecha as conexões abertas ao sair.
+        if self.armazenamento is not None:
+            self.armazenamento.fechar()  # Fecha o banco das conversas.
+        self.metricas.fechar()  # Grava os últimos registros das métricas.
+        super().closeEvent(evento)
+
     # Métodos para configurar e ajustar a interface do usuário, como tamanho, cor e posição dos componentes.
     def set_posicao_visor(self, visor_temperatura, x, y):
         visor_temperatura.move(x, y)  # Move o visor de temperatura para a posição especificada.
@@ -187,13 +709,15 @@ class ChatApp(QWidget):  # Define uma classe que herda de QWidget.
         remetente = self.sender()  # Obtém o remetente do sinal.
         if remetente == self.botao_GPT3:
             self.modelo = "gpt-3.5-turbo-16k"  # Altera o modelo para GPT-3.5.
-            self.resultados.append("<b>Modelo alterado para:</b> GPT-3.5")
+            self.adicionar_aviso_ui("<b>Modelo alterado para:</b> GPT-3.5")
+            self.atualizar_tokens_prompt()  # O limite de contexto mudou junto com o modelo.
 
     def mudar_modelo_gpt4(self):
         remetente = self.sender()  # Obtém o remetente do sinal.
         if remetente == self.botao_GPT4:
             self.modelo = "gpt-4-0613"  # Altera o modelo para GPT-4.
-            self.resultados.append("<b>Modelo alterado para:</b> GPT-4")
+            self.adicionar_aviso_ui("<b>Modelo alterado para:</b> GPT-4")
+            self.atualizar_tokens_prompt()  # O limite de contexto mudou junto com o modelo.
 
     def set_posicao_botao_gpt3(self, botao_GPT3, x, y):
         botao_GPT3.move(x, y)  # Move o botão GPT3 para a posição especificada.
@@ -228,7 +752,6 @@ class ChatApp(QWidget):  # Define uma classe que herda de QWidget.
 
     def set_tamanho_resultados(self, width, height):
         self.resultados.setFixedSize(width, height)  # Define o tamanho da área de resultados.
-        self.resultados.setAlignment(Qt.AlignLeft)  # Alinha o texto à esquerda.
 
     def set_cor_fundo_entrada(self, cor):
         self.entrada.setStyleSheet(f"background-color: {cor}; border: 1px solid #000000; border-radius: 10px; color: #ffffff;")
@@ -272,6 +795,10 @@ class ChatApp(QWidget):  # Define uma classe que herda de QWidget.
         fonte.setPointSize(11)  # Define o tamanho da fonte.
         self.resultados.setFont(fonte)  # Aplica a fonte à área de resultados.
 
+    def set_cor_fundo_painel_metricas(self, cor):
+        self.painel_metricas.setStyleSheet(f"background-color: {cor}; border: 1px solid #3c3c3c; border-radius: 10px; color: #ffffff;")
+        # Define a cor de fundo, borda e texto do painel de métricas.
+
     def set_cor_fundo_app(self, cor):
         self.setStyleSheet(f"background-color: {cor};")  # Define a cor de fundo da aplicação.
 
@@ -284,72 +811,191 @@ class ChatApp(QWidget):  # Define uma classe que herda de QWidget.
 
     # Métodos para enviar mensagens, limpar campos, ajustar temperatura, trocar modelos, e atualizar contadores.
     def enviar_mensagem(self):
+        self.iniciar_servicos()  # Garante que o cliente HTTP já existe.
         mensagem = self.entrada.toPlainText()  # Obtém a mensagem da entrada de texto.
+        if self.erro_tokenizador is not None:
+            self.mostrar_erro_tokenizador()
+            return
+        if not self.tokenizador_pronto:  # Montar o prompt agora travaria a interface até o tokenizador carregar.
+            self.envios_pendentes.append(mensagem)
+            self.label_status.setText("Aguardando o tokenizador...")
+            self.label_status.show()
+            return
+        self.enviar_texto(mensagem)
+
+    # Monta o prompt com o histórico e entrega a pergunta ao agendador. Só é chamado com o tokenizador pronto.
+    def enviar_texto(self, mensagem):
         self.label_status.setText("Carregando resposta...")  # Define o texto do status.
         self.label_status.show()  # Mostra o status.
         QApplication.processEvents()  # Atualiza a interface do usuário.
         mensagem_usuario = {"role": "user", "content": mensagem}  # Cria um dicionário com a mensagem do usuário.
-        self.historico_conversa.append(mensagem_usuario)  # Adiciona a mensagem ao histórico de conversa.
-        self.trabalhador = Worker(self, mensagem)  # Cria uma instância da classe Worker.
-        self.trabalhador.terminado.connect(self.atualizar_ui)  # Conecta o sinal terminado ao método atualizar_ui.
-        self.trabalhador.start()  # Inicia o thread.
+        # A pergunta só entra no histórico junto com a resposta (em atualizar_ui), na ordem dos turnos.
+        mensagens, tokens_prompt, max_tokens = self.contexto.montar(self.modelo, extras=[mensagem_usuario])  # Histórico que cabe no contexto.
+        trabalhador = Worker(self, self.agendador.novo_turno(), mensagem, mensagens, tokens_prompt, max_tokens)  # Cria uma instância da classe Worker.
+        self.agendador.enviar(trabalhador)  # Inicia agora ou assim que houver vaga.
 
     def limpar_campos(self):
+        self.agendador.cancelar_todos()  # Interrompe as requisições em andamento.
+        self.envios_pendentes.clear()  # Também as que ainda esperavam o tokenizador.
         self.entrada.clear()  # Limpa a entrada de texto.
-        self.resultados.clear()  # Limpa a área de resultados.
+        self.primeira_mensagem_id = None  # As mensagens apagadas da tela não voltam ao rolar.
+        self.renderizador.descartar()  # As mensagens apagadas não precisam mais ser formatadas.
+        self.renderizados.clear()
+        self.transcricao.limpar()  # Limpa a área de resultados.
+
+    def set_tamanho_painel_metricas(self, width, height):
+        self.painel_metricas.setFixedSize(width, height)  # Define o tamanho do painel de métricas.
 
     def set_tamanho_contador(self, width, height):
         self.contador_tokens.setFixedSize(width, height)  # Define o tamanho do contador de tokens.
         self.contador_tokens.setAlignment(Qt.AlignTop)  # Alinha o texto no topo.
 
-    def atualizar_contador_caracteres(self):
+    def atualizar_contagem_tokens(self):
         mensagem = self.entrada.toPlainText()  # Obtém a mensagem da entrada de texto.
         self.contador_caracteres = len(mensagem)  # Atualiza a contagem de caracteres.
+        self.contador.pedir(mensagem)  # Pede a contagem de tokens ao thread do contador.
         self.atualizar_texto_contador()  # Atualiza o texto do contador.
 
-    def atualizar_contagem_tokens(self):
-        mensagem = self.entrada.toPlainText()  # Obtém a mensagem da entrada de texto.
-        tokens_mensagem = tokenizador.encode(mensagem)  # Codifica a mensagem em tokens.
-        self.tokens_mensagem = len(tokens_mensagem)  # Atualiza a contagem de tokens.
+    def receber_contagem_tokens(self, tokens_mensagem):
+        self.tokens_mensagem = tokens_mensagem  # Atualiza a contagem de tokens.
+        self.atualizar_tokens_prompt()
+
+    # Estima o tamanho total do próximo prompt: histórico que cabe no contexto mais a mensagem digitada.
+    def atualizar_tokens_prompt(self):
+        if not self.tokenizador_pronto:
+            return  # Ainda não dá para contar sem travar a interface.
+        consulta = self.entrada.toPlainText()  # Em conversas longas, o histórico enviado depende da pergunta.
+        tokens_historico = self.contexto.montar(self.modelo, consulta=consulta)[1]  # Usa as contagens já guardadas do histórico.
+        self.tokens_prompt = tokens_historico + self.tokens_mensagem + GerenciadorContexto.tokens_por_mensagem
         self.atualizar_texto_contador()  # Atualiza o texto do contador.
-        self.timer_contagem_tokens.stop()  # Para o timer.
 
     def atualizar_texto_contador(self):
-        texto_contador_tokens = f"Tokens na mensagem: {self.tokens_mensagem}, Tokens na resposta: {self.tokens_resposta}, Caracteres: {self.contador_caracteres}"
+        if self.erro_tokenizador is not None:
+            self.contador_tokens.setText(f"Tokens: erro ao carregar o tokenizador ({self.erro_tokenizador}), Caracteres: {self.contador_caracteres}")
+            return
+        if not self.tokenizador_pronto:
+            self.contador_tokens.setText(f"Tokens: carregando tokenizador..., Caracteres: {self.contador_caracteres}")  # Aviso até o tokenizador carregar.
+            return
+        texto_contador_tokens = f"Tokens na mensagem: {self.tokens_mensagem}, Tokens no prompt: {self.tokens_prompt}, Tokens na resposta: {self.tokens_resposta}, Caracteres: {self.contador_caracteres}"
         # Texto com a contagem de tokens e caracteres.
         self.contador_tokens.setText(texto_contador_tokens)  # Define o texto no contador de tokens.
 
+    def atualizar_ui_parcial(self, mensagem, trecho):
+        if not self.bloco_gpt_aberto:  # Primeiro trecho: abre o bloco da resposta.
+            if self.agendador.pendentes() == 1:
+                self.label_status.hide()  # Esconde o status se esta é a única resposta pendente.
+            self.adicionar_mensagem_ui("EU", mensagem, Qt.AlignRight)  # Adiciona a mensagem do usuário à UI.
+            self.id_resposta_aberta = self.adicionar_mensagem_ui("GPT", "", Qt.AlignLeft, aberto=True)['id']  # Abre o bloco da resposta da API.
+            self.bloco_gpt_aberto = True
+        no_fim = self.esta_no_fim()
+        self.transcricao.anexar(self.id_resposta_aberta, trecho)  # Acrescenta o trecho ao bloco aberto, mesmo depois de um aviso.
+        if not self.timer_streaming.isActive():
+            self.timer_streaming.start()  # Formata a resposta depois do intervalo, juntando os trechos que chegarem até lá.
+        if no_fim:
+            self.resultados.scrollToBottom()  # Acompanha a resposta enquanto ela chega.
+
     def atualizar_ui(self, mensagem, resposta, contagem_tokens):
-        self.label_status.hide()  # Esconde o status.
-        QApplication.processEvents()  # Atualiza a interface do usuário.
+        if not self.agendador.pendentes():
+            self.label_status.hide()  # Esconde o status quando não há mais respostas pendentes.
+        self.atualizar_painel_metricas()  # A requisição já foi registrada pelo Worker.
+        if self.bloco_gpt_aberto and self.id_resposta_aberta in self.transcricao.por_id:
+            self.timer_streaming.stop()
+            self.renderizar(self.transcricao.por_id[self.id_resposta_aberta])  # Formata a resposta do streaming por inteiro (ou o que chegou antes do erro).
+        if resposta.get('cancelado'):
+            self.bloco_gpt_aberto = False  # Requisição cancelada: nada entra no histórico.
+            return
         if resposta and 'choices' in resposta and len(resposta['choices']) > 0:
             resposta_modelo = resposta['choices'][0]['message']['content']  # Obtém a resposta da API.
-            self.adicionar_mensagem_ui("EU", mensagem, Qt.AlignRight)  # Adiciona a mensagem do usuário à UI.
-            self.adicionar_mensagem_ui("GPT", resposta_modelo, Qt.AlignLeft)  # Adiciona a resposta da API à UI.
+            if not self.bloco_gpt_aberto:  # No modo sem streaming (ou vinda do cache), exibe a conversa inteira de uma vez.
+                remetente = "GPT (cache)" if resposta.get('cache') else "GPT"  # Indica quando a resposta veio do cache.
+                self.adicionar_mensagem_ui("EU", mensagem, Qt.AlignRight)  # Adiciona a mensagem do usuário à UI.
+                self.adicionar_mensagem_ui(remetente, resposta_modelo, Qt.AlignLeft)  # Adiciona a resposta da API à UI.
+            self.bloco_gpt_aberto = False
             mensagem_chatbot = {"role": "assistant", "content": resposta_modelo}  # Cria um dicionário com a resposta da API.
-            self.historico_conversa.append(mensagem_chatbot)  # Adiciona a resposta ao histórico de conversa.
+            self.contexto.adicionar({"role": "user", "content": mensagem})  # Adiciona a pergunta ao histórico de conversa.
+            self.contexto.adicionar(mensagem_chatbot)  # Adiciona a resposta ao histórico de conversa.
             self.tokens_resposta = contagem_tokens  # Atualiza a contagem de tokens da resposta.
-            self.atualizar_texto_contador()  # Atualiza o texto do contador.
+            self.atualizar_tokens_prompt()  # O histórico mudou: recalcula o prompt e atualiza o contador.
+            self.gravar_mensagens(2)  # Grava a pergunta e a resposta no banco.
         else:
-            self.resultados.append("<b>Erro:</b> Não foi possível obter uma resposta.")  # Mensagem de erro.
-
-    def adicionar_mensagem_ui(self, remetente, mensagem, alinhamento):
-        cursor = self.resultados.textCursor()  # Obtém o cursor da área de resultados.
-        cursor.movePosition(QTextCursor.End)  # Move o cursor para o final.
-        formato_bloco = QTextBlockFormat()  # Cria um formato de bloco de texto.
-        formato_bloco.setAlignment(alinhamento)  # Define o alinhamento do bloco.
-        cursor.insertBlock(formato_bloco)  # Insere o bloco de texto.
-        mensagem_formatada = f"<b>{remetente}:</b><br>{mensagem}<br>"  # Formata a mensagem.
-        cursor.insertHtml(mensagem_formatada)  # Insere a mensagem formatada como HTML.
-        self.resultados.append(" ")  # Adiciona um espaço após a mensagem.
-
-# Bloco principal para iniciar a aplicação.
-if __name__ == "__main__":
-    app = QApplication(sys.argv)  # Cria a aplicação Qt.
-    app_chat = ChatApp()  # Cria uma instância da aplicação de chat.
-    app_chat.show()  # Mostra a janela da aplicação.
-
-    # Configurações adicionais de UI para cor e tamanho.
+            self.bloco_gpt_aberto = False
+            self.adicionar_aviso_ui("<b>Erro:</b> Não foi possível obter uma resposta.")  # Mensagem de erro.
+        estatisticas = self.cache.estatisticas()  # Acertos e falhas do cache, exibidos ao passar o mouse no contador.
+        self.contador_tokens.setToolTip(f"Cache: {estatisticas['acertos']} acertos, {estatisticas['falhas']} falhas ({estatisticas['taxa_acerto']:.0%})")
+
+    # Mostra a latência p50/p95 e o gasto estimado; os detalhes aparecem ao passar o mouse.
+    def atualizar_painel_metricas(self):
+        resumo = self.metricas.resumo()
+        if not resumo["requisicoes"]:
+            return
+        latencia = resumo["latencia_ms"]
+        self.painel_metricas.setText(f"p50 {latencia['p50'] / 1000:.1f}s · p95 {latencia['p95'] / 1000:.1f}s · "
+                                     f"{resumo['requisicoes']} req · US$ {resumo['custo_usd']:.4f}")
+        detalhes = []
+        for campo, nome in (("espera_fila_ms", "Fila"), ("espera_limite_ms", "Limite de uso"), ("conexao_ms", "Conexão"),
+                            ("ttfb_ms", "1º byte"), ("primeiro_trecho_ms", "1º trecho"), ("latencia_ms", "Total")):
+            if resumo[campo]:
+                detalhes.append(f"{nome}: p50 {resumo[campo]['p50']:.0f} ms, p95 {resumo[campo]['p95']:.0f} ms, p99 {resumo[campo]['p99']:.0f} ms")
+        for modelo, totais in resumo["por_modelo"].items():
+            detalhes.append(f"{modelo}: {totais['requisicoes']} req, {totais['erros']} erros, "
+                            f"{totais['tokens_prompt']}+{totais['tokens_resposta']} tokens, US$ {totais['custo_usd']:.4f}")
+        self.painel_metricas.setToolTip("\n".join(detalhes))
+
+    # Adiciona uma mensagem ao fim da transcrição; com aberto=True, ela recebe os trechos do streaming depois.
+    def adicionar_mensagem_ui(self, remetente, mensagem, alinhamento, aberto=False):
+        no_fim = self.esta_no_fim()
+        item = self.transcricao.adicionar(remetente, mensagem, alinhamento)
+        if not aberto:
+            self.renderizar(item)  # A mensagem aparece como texto puro até a formatação ficar pronta.
+        if no_fim:
+            self.resultados.scrollToBottom()  # Acompanha as mensagens novas, se o usuário não rolou para cima.
+        return item
+
+    # Pede a formatação de uma mensagem ao thread do renderizador (avisos já vêm em HTML).
+    def renderizar(self, item, cachear=True):
+        if item['remetente'] is not None and item['texto']:
+            self.renderizador.pedir(item['id'], item['texto'], cachear)
+
+    # Formata o que já chegou da resposta em streaming, sem guardar esse texto parcial no cache.
+    def renderizar_resposta_aberta(self):
+        item = self.transcricao.por_id.get(self.id_resposta_aberta)
+        if self.bloco_gpt_aberto and item is not None:
+            self.renderizar(item, cachear=False)
+
+    def receber_renderizado(self, id_mensagem, tamanho, html_formatado):
+        self.renderizados.append((id_mensagem, tamanho, html_formatado))
+        if not self.timer_renderizados.isActive():
+            self.timer_renderizados.start(0)  # Aplica no próximo ciclo do loop de eventos.
+
+    # Aplica as mensagens formatadas por no máximo ~8 ms de cada vez; o resto fica para o próximo
+    # ciclo, depois do desenho da tela, então nenhum quadro passa de 16 ms por causa da formatação.
+    # A formatação muda a altura das mensagens: a que está no topo da tela fica no mesmo lugar
+    # (ou a lista continua no fim, se já estava lá).
+    def aplicar_renderizados(self):
+        no_fim = self.esta_no_fim()
+        ancora = QPersistentModelIndex(self.resultados.indexAt(QPoint(0, 0)))  # Mensagem no topo da tela.
+        topo = self.resultados.visualRect(QModelIndex(ancora)).top()
+        limite = time.perf_counter() + 0.008
+        while self.renderizados and time.perf_counter() < limite:
+            self.transcricao.definir_html(*self.renderizados.popleft())
+        if no_fim:
+            self.resultados.scrollToBottom()
+        elif ancora.isValid():
+            barra = self.resultados.verticalScrollBar()
+            barra.setValue(barra.value() + self.resultados.visualRect(QModelIndex(ancora)).top() - topo)
+        if self.renderizados:
+            self.timer_renderizados.start(0)
+
+    # Adiciona um aviso já formatado em HTML (troca de modelo, erros).
+    def adicionar_aviso_ui(self, html):
+        self.adicionar_mensagem_ui(None, html, Qt.AlignLeft)
+
+    def esta_no_fim(self):
+        barra = self.resultados.verticalScrollBar()
+        return barra.value() >= barra.maximum()
+
+# Aplica as configurações de cor e tamanho da interface.
+def configurar_aparencia(app_chat):
     app_chat.set_tamanho_visor(65, 30)  # Define o tamanho do visor de temperatura.
     app_chat.set_tamanho_entrada(545, 50)  # Define o tamanho da entrada de texto.
     app_chat.set_tamanho_botao_enviar(50, 50)  # Define o tamanho do botão de enviar.
@@ -360,6 +1006,7 @@ if __name__ == "__main__":
     app_chat.set_tamanho_botao_gpt4(65, 30)  # Define o tamanho do botão GPT4.
     app_chat.set_tamanho_resultados(650, 580)  # Define o tamanho da área de resultados.
     app_chat.set_tamanho_contador(650, 30)  # Define o tamanho do contador de tokens.
+    app_chat.set_tamanho_painel_metricas(260, 30)  # Define o tamanho do painel de métricas.
 
     app_chat.set_cor_fundo_visor("#515151")  # Define a cor de fundo do visor de temperatura.
     app_chat.set_cor_fundo_entrada("#515151")  # Define a cor de fundo da entrada de texto.
@@ -371,6 +1018,17 @@ if __name__ == "__main__":
     app_chat.set_cor_fundo_botao_aumentar_temp("#4CAF50")  # Define a cor de fundo do botão de aumentar temperatura.
     app_chat.set_cor_fundo_botao_diminuir_temp("#4CAF50")  # Define a cor de fundo do botão de diminuir temperatura.
     app_chat.set_cor_fundo_contador("#3c3c3c")  # Define a cor de fundo do contador de tokens.
+    app_chat.set_cor_fundo_painel_metricas("#3c3c3c")  # Define a cor de fundo do painel de métricas.
     app_chat.set_cor_fundo_app("#3c3c3c")  # Define a cor de fundo da aplicação.
 
+# Bloco principal para iniciar a aplicação.
+if __name__ == "__main__":
+    if "--batch" in sys.argv:  # Modo em lote, sem abrir a janela.
+        import lote
+        sys.exit(lote.main(sys.argv[1:]))
+    app = QApplication(sys.argv)  # Cria a aplicação Qt.
+    app_chat = ChatApp()  # Cria uma instância da aplicação de chat.
+    app_chat.show()  # Mostra a janela da aplicação.
+    configurar_aparencia(app_chat)  # Configurações adicionais de UI para cor e tamanho.
+
     sys.exit(app.exec_())  # Executa o loop principal da aplicação.
@@ -0,0 +1,80 @@
+# Armazenamento das conversas em SQLite, sem dependência do Qt.
+# Cada mensagem é gravada assim que entra no histórico (nada de regravar a conversa inteira),
+# junto com a sua contagem de tokens, e a leitura é feita por páginas: ao abrir uma conversa
+# só as mensagens mais recentes são carregadas; as anteriores vêm sob demanda.
+import os  # Biblioteca para montar o caminho do banco.
+import sqlite3  # Banco de dados embutido do Python.
+import time  # Biblioteca para registrar a data das mensagens.
+from dotenv import load_dotenv  # Biblioteca para carregar variáveis de ambiente de um arquivo .env.
+
+load_dotenv()  # Carrega as variáveis de ambiente do arquivo .env.
+caminho_banco = os.getenv('CONVERSAS_DB', os.path.join(os.path.expanduser("~"), ".gptzinho", "conversas.sqlite3"))  # Onde as conversas ficam guardadas.
+mensagens_por_pagina = int(os.getenv('MENSAGENS_POR_PAGINA', "50"))  # Mensagens carregadas de cada vez.
+
+class ArmazenamentoConversas:
+    def __init__(self, caminho=caminho_banco):
+        if caminho != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(caminho)), exist_ok=True)
+        self.conexao = sqlite3.connect(caminho)
+        self.conexao.execute("PRAGMA journal_mode=WAL")  # Cada gravação só acrescenta ao log, sem reescrever o banco.
+        self.conexao.execute("PRAGMA synchronous=NORMAL")
+        self.conexao.executescript("""
+            CREATE TABLE IF NOT EXISTS conversas (
+                id INTEGER PRIMARY KEY,
+                titulo TEXT NOT NULL DEFAULT '',
+                criada_em REAL NOT NULL,
+                atualizada_em REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS mensagens (
+                id INTEGER PRIMARY KEY,
+                conversa_id INTEGER NOT NULL REFERENCES conversas(id),
+                papel TEXT NOT NULL,
+                conteudo TEXT NOT NULL,
+                tokens INTEGER,
+                criada_em REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS mensagens_por_conversa ON mensagens (conversa_id, id);
+        """)
+        self.conexao.commit()
+
+    def nova_conversa(self, titulo=""):
+        agora = time.time()
+        cursor = self.conexao.execute("INSERT INTO conversas (titulo, criada_em, atualizada_em) VALUES (?, ?, ?)",
+                                      (titulo, agora, agora))
+        self.conexao.commit()
+        return cursor.lastrowid
+
+    # Conversa usada por último, ou None se ainda não há nenhuma.
+    def ultima_conversa(self):
+        linha = self.conexao.execute("SELECT id FROM conversas ORDER BY atualizada_em DESC, id DESC LIMIT 1").fetchone()
+        return linha[0] if linha else None
+
+    # Acrescenta uma mensagem à conversa e retorna o id dela.
+    def adicionar_mensagem(self, conversa_id, papel, conteudo, tokens=None):
+        agora = time.time()
+        cursor = self.conexao.execute(
+            "INSERT INTO mensagens (conversa_id, papel, conteudo, tokens, criada_em) VALUES (?, ?, ?, ?, ?)",
+            (conversa_id, papel, conteudo, tokens, agora))
+        self.conexao.execute("UPDATE conversas SET atualizada_em = ? WHERE id = ?", (agora, conversa_id))
+        self.conexao.commit()
+        return cursor.lastrowid
+
+    # As mensagens mais recentes da conversa, em ordem cronológica: [(id, papel, conteudo, tokens), ...].
+    def carregar_recentes(self, conversa_id, limite=mensagens_por_pagina):
+        linhas = self.conexao.execute(
+            "SELECT id, papel, conteudo, tokens FROM mensagens WHERE conversa_id = ? ORDER BY id DESC LIMIT ?",
+            (conversa_id, limite)).fetchall()
+        return linhas[::-1]
+
+    # A página de mensagens anterior à mensagem antes_de_id, em ordem cronológica.
+    def carregar_anteriores(self, conversa_id, antes_de_id, limite=mensagens_por_pagina):
+        linhas = self.conexao.execute(
+            "SELECT id, papel, conteudo, tokens FROM mensagens WHERE conversa_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+            (conversa_id, antes_de_id, limite)).fetchall()
+        return linhas[::-1]
+
+    def contar_mensagens(self, conversa_id):
+        return self.conexao.execute("SELECT COUNT(*) FROM mensagens WHERE conversa_id = ?", (conversa_id,)).fetchone()[0]
+
+    def fechar(self):
+        self.conexao.close()
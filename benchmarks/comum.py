@@ -0,0 +1,19 @@
+# Funções usadas por todos os benchmarks: isolamento dos dados do usuário e estatísticas dos tempos.
+import os  # Biblioteca para apontar o app para a pasta temporária.
+import tempfile  # Biblioteca para criar a pasta temporária dos dados.
+
+def ms(segundos):
+    return round(segundos * 1000, 3)  # Converte segundos para milissegundos.
+
+# Aponta o banco de conversas e o cache para uma pasta temporária e desliga os arquivos de métricas,
+# para o benchmark não ler nem alterar os dados do usuário. Deve rodar antes de importar o app.
+def isolar_dados():
+    pasta = tempfile.mkdtemp(prefix="gptzinho-benchmark-")
+    os.environ["CONVERSAS_DB"] = os.path.join(pasta, "conversas.sqlite3")
+    os.environ["CACHE_DIR"] = os.path.join(pasta, "cache")
+    os.environ["METRICAS_JSONL"] = os.environ["METRICAS_PROMETHEUS"] = ""  # Vazias: o .env não as redefine.
+    return pasta
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(int(len(ordenados) * p / 100), len(ordenados) - 1)]
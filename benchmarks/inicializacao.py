@@ -0,0 +1,65 @@
+# Mede o tempo de inicialização do app: importação do módulo, primeira pintura da janela
+# e carregamento do tokenizador em segundo plano. Rode em um processo novo para medir a partida a frio:
+#   python benchmarks/inicializacao.py [--meta-ms 1000]
+# O resultado é impresso em JSON; o código de saída é 1 se a primeira pintura passar da meta.
+import time
+inicio = time.perf_counter()  # Marca o início antes de qualquer importação pesada.
+
+import argparse  # Biblioteca para ler os argumentos da linha de comando.
+import json  # Biblioteca para imprimir o resultado.
+import os  # Biblioteca para montar o caminho do app.
+import shutil  # Biblioteca para apagar a pasta temporária dos dados.
+import sys  # Biblioteca para ajustar o caminho de importação e o código de saída.
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Permite importar app.py da raiz.
+
+from comum import ms, isolar_dados  # Funções comuns aos benchmarks (da pasta deste script).
+
+def main():
+    parser = argparse.ArgumentParser(description="Mede o tempo de inicialização do app.")
+    parser.add_argument("--meta-ms", type=float, default=1000, help="Meta para a primeira pintura da janela, em ms.")
+    parser.add_argument("--timeout", type=float, default=60, help="Tempo máximo de espera pelo tokenizador, em s.")
+    args = parser.parse_args()
+
+    pasta_dados = isolar_dados()
+    t0 = time.perf_counter()
+    import app  # Importa o módulo da aplicação.
+    from PyQt5.QtCore import QObject, QEvent, QTimer
+    from PyQt5.QtWidgets import QApplication
+    tempos = {"importacao_ms": ms(time.perf_counter() - t0)}
+
+    # Filtro de eventos que registra a primeira pintura da janela.
+    class FiltroPintura(QObject):
+        def eventFilter(self, objeto, evento):
+            if evento.type() == QEvent.Paint and "primeira_pintura_ms" not in tempos:
+                tempos["primeira_pintura_ms"] = ms(time.perf_counter() - inicio)
+            return False
+
+    aplicacao = QApplication(sys.argv)
+    app_chat = app.ChatApp()
+    filtro = FiltroPintura()
+    app_chat.installEventFilter(filtro)
+    app_chat.show()
+    app.configurar_aparencia(app_chat)
+
+    def verificar_tokenizador():
+        if app_chat.tokenizador_pronto:  # Marcado pela própria janela quando o carregador termina.
+            tempos["tokenizador_pronto_ms"] = ms(time.perf_counter() - inicio)
+            aplicacao.quit()
+
+    verificador = QTimer()
+    verificador.setInterval(5)
+    verificador.timeout.connect(verificar_tokenizador)
+    verificador.start()
+    QTimer.singleShot(int(args.timeout * 1000), aplicacao.quit)  # Não espera para sempre se o download travar.
+    aplicacao.exec_()
+    app_chat.close()
+    shutil.rmtree(pasta_dados, ignore_errors=True)
+
+    tempos["meta_primeira_pintura_ms"] = args.meta_ms
+    tempos["dentro_da_meta"] = tempos.get("primeira_pintura_ms", float("inf")) <= args.meta_ms
+    print(json.dumps(tempos, indent=2))
+    return 0 if tempos["dentro_da_meta"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+# Servidor local que imita o endpoint /v1/chat/completions da OpenAI, para testes e benchmarks
+# sem usar a API real. Permite configurar a latência até o primeiro byte, a velocidade de geração
+# (tokens por segundo), o tamanho das respostas, a injeção de erros 429 e 500 e limites de uso
+# (requisições e tokens por janela) aplicados de verdade, com os cabeçalhos x-ratelimit-* da API.
+#   python benchmarks/servidor_simulado.py --porta 8000 --latencia 0.2 --tokens-por-segundo 50
+# Depois, aponte o app para ele com API_URL=http://127.0.0.1:8000/v1/chat/completions.
+import argparse  # Biblioteca para ler os argumentos da linha de comando.
+import json  # Biblioteca para ler as requisições e montar as respostas.
+import random  # Biblioteca para sortear os erros injetados.
+import threading  # Biblioteca para rodar o servidor em segundo plano.
+import time  # Biblioteca para simular a latência e a velocidade de geração.
+from collections import deque  # Janela das requisições aceitas, para os limites de uso.
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # Servidor HTTP da biblioteca padrão.
+
+class ManipuladorChat(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Mantém a conexão aberta entre requisições (keep-alive).
+    disable_nagle_algorithm = True  # Cabeçalhos e corpo saem em envios separados; sem isso o ACK atrasado soma ~40 ms.
+
+    def log_message(self, formato, *args):
+        pass  # Não polui a saída dos benchmarks.
+
+    def handle(self):
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Cliente fechou a conexão (ex.: ao cancelar ou ao fechar o pool).
+
+    def enviar_json(self, status, corpo, cabecalhos=None):
+        dados = json.dumps(corpo).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(dados)))
+        for nome, valor in (cabecalhos or {}).items():
+            self.send_header(nome, valor)
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def do_POST(self):
+        config = self.server.config
+        tamanho = int(self.headers.get("Content-Length", 0))
+        dados = json.loads(self.rfile.read(tamanho) or b"{}")
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            self.enviar_json(404, {"error": {"message": "not found"}})
+            return
+        mensagens = dados.get("messages", [])
+        tokens_prompt = sum(len(str(m.get("content", "")).split()) + 4 for m in mensagens)
+        tokens_resposta = min(config["tokens_resposta"], dados.get("max_tokens") or config["tokens_resposta"])
+        uso = {"prompt_tokens": tokens_prompt, "completion_tokens": tokens_resposta, "total_tokens": tokens_prompt + tokens_resposta}
+        with self.server.trava:
+            self.server.requisicoes += 1
+            cabecalhos_limite, aceita = self.server.consumir_limite(uso["total_tokens"])
+        sorteio = random.random()
+        if not aceita or sorteio < config["taxa_429"]:  # Erro de limite de uso, com o tempo de espera sugerido.
+            with self.server.trava:
+                self.server.recusadas += 1
+            if aceita:
+                cabecalhos_limite["retry-after"] = str(config["retry_after"])
+            self.enviar_json(429, {"error": {"message": "Rate limit reached", "type": "requests"}}, cabecalhos_limite)
+            return
+        if sorteio < config["taxa_429"] + config["taxa_500"]:
+            self.enviar_json(500, {"error": {"message": "The server had an error", "type": "server_error"}})
+            return
+
+        time.sleep(config["latencia"])  # Tempo até o primeiro byte.
+        palavras = [f" palavra{i}" for i in range(tokens_resposta)]  # Cada palavra conta como um token.
+        intervalo = 1.0 / config["tokens_por_segundo"] if config["tokens_por_segundo"] > 0 else 0.0
+
+        if not dados.get("stream"):
+            time.sleep(intervalo * tokens_resposta)  # Sem streaming, a resposta só sai inteira.
+            self.enviar_json(200, {
+                "id": "chatcmpl-simulado", "object": "chat.completion", "model": dados.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(palavras).strip()}, "finish_reason": "stop"}],
+                "usage": uso
+            }, cabecalhos_limite)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        for nome, valor in cabecalhos_limite.items():
+            self.send_header(nome, valor)
+        self.end_headers()
+        for palavra in palavras:
+            evento = {"id": "chatcmpl-simulado", "object": "chat.completion.chunk",
+                      "choices": [{"index": 0, "delta": {"content": palavra}, "finish_reason": None}]}
+            self.escrever_evento(json.dumps(evento))
+            time.sleep(intervalo)
+        if (dados.get("stream_options") or {}).get("include_usage"):
+            self.escrever_evento(json.dumps({"id": "chatcmpl-simulado", "choices": [], "usage": uso}))
+        self.escrever_evento("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")  # Fim do corpo em partes (chunked).
+
+    def escrever_evento(self, conteudo):
+        dados = f"data: {conteudo}\n\n".encode("utf-8")
+        self.wfile.write(f"{len(dados):x}\r\n".encode("ascii") + dados + b"\r\n")
+        self.wfile.flush()
+
+# Servidor HTTP com a configuração e os limites de uso compartilhados pelos manipuladores.
+class ServidorHTTPSimulado(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, endereco, config):
+        super().__init__(endereco, ManipuladorChat)
+        self.config = config  # Pode ser alterada com o servidor rodando.
+        self.trava = threading.Lock()
+        self.requisicoes = 0  # Requisições recebidas.
+        self.recusadas = 0  # Respostas 429 enviadas.
+        self.aceitas = deque()  # (instante, tokens) das requisições aceitas dentro da janela.
+
+    # Verifica e desconta os limites de requisições e tokens da janela, como a API faz.
+    # Retorna os cabeçalhos x-ratelimit-* e se a requisição cabe. Deve ser chamado com a trava adquirida.
+    def consumir_limite(self, tokens):
+        config = self.config
+        agora = time.monotonic()
+        while self.aceitas and agora - self.aceitas[0][0] >= config["janela"]:
+            self.aceitas.popleft()
+        usados = sum(t for _, t in self.aceitas)
+        aceita = len(self.aceitas) < config["limite_requisicoes"] and usados + tokens <= config["limite_tokens"]
+        if aceita:
+            self.aceitas.append((agora, tokens))
+            usados += tokens
+        renovacao = self.aceitas[-1][0] + config["janela"] - agora if self.aceitas else 0.0  # Quando a janela esvazia (limite cheio).
+        proxima_vaga = self.aceitas[0][0] + config["janela"] - agora if self.aceitas else 0.0  # Quando a mais antiga sai.
+        cabecalhos = {
+            "x-ratelimit-limit-requests": str(config["limite_requisicoes"]),
+            "x-ratelimit-remaining-requests": str(config["limite_requisicoes"] - len(self.aceitas)),
+            "x-ratelimit-reset-requests": f"{renovacao:.3f}s",
+            "x-ratelimit-limit-tokens": str(config["limite_tokens"]),
+            "x-ratelimit-remaining-tokens": str(max(config["limite_tokens"] - usados, 0)),
+            "x-ratelimit-reset-tokens": f"{renovacao:.3f}s"
+        }
+        if not aceita:
+            cabecalhos["retry-after-ms"] = str(int(proxima_vaga * 1000) + 1)
+        return cabecalhos, aceita
+
+# Servidor simulado que pode ser iniciado de dentro de outro script (ex.: os benchmarks).
+class ServidorSimulado:
+    def __init__(self, porta=0, latencia=0.05, tokens_por_segundo=200, tokens_resposta=50,
+                 taxa_429=0.0, taxa_500=0.0, retry_after=1, limite_requisicoes=3500, limite_tokens=90000, janela=60.0):
+        self.servidor = ServidorHTTPSimulado(("127.0.0.1", porta), {
+            "latencia": latencia, "tokens_por_segundo": tokens_por_segundo, "tokens_resposta": tokens_resposta,
+            "taxa_429": taxa_429, "taxa_500": taxa_500, "retry_after": retry_after,
+            "limite_requisicoes": limite_requisicoes, "limite_tokens": limite_tokens, "janela": janela
+        })
+        self.thread = None
+
+    @property
+    def url(self):
+        host, porta = self.servidor.server_address[:2]
+        return f"http://{host}:{porta}/v1/chat/completions"
+
+    @property
+    def config(self):
+        return self.servidor.config  # Pode ser alterado com o servidor rodando.
+
+    def iniciar(self):
+        self.thread = threading.Thread(target=self.servidor.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def fechar(self):
+        self.servidor.shutdown()
+        self.servidor.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor local que imita /v1/chat/completions.")
+    parser.add_argument("--porta", type=int, default=8000)
+    parser.add_argument("--latencia", type=float, default=0.05, help="Segundos até o primeiro byte.")
+    parser.add_argument("--tokens-por-segundo", type=float, default=200, help="Velocidade de geração (0 = instantâneo).")
+    parser.add_argument("--tokens-resposta", type=int, default=50, help="Tokens em cada resposta.")
+    parser.add_argument("--taxa-429", type=float, default=0.0, help="Fração das requisições que recebem 429.")
+    parser.add_argument("--taxa-500", type=float, default=0.0, help="Fração das requisições que recebem 500.")
+    parser.add_argument("--retry-after", type=float, default=1, help="Valor do cabeçalho retry-after nas respostas 429 sorteadas.")
+    parser.add_argument("--limite-requisicoes", type=int, default=3500, help="Requisições aceitas por janela.")
+    parser.add_argument("--limite-tokens", type=int, default=90000, help="Tokens aceitos por janela.")
+    parser.add_argument("--janela", type=float, default=60.0, help="Duração (s) da janela dos limites.")
+    args = parser.parse_args()
+    servidor = ServidorSimulado(args.porta, args.latencia, args.tokens_por_segundo, args.tokens_resposta,
+                                args.taxa_429, args.taxa_500, args.retry_after, args.limite_requisicoes,
+                                args.limite_tokens, args.janela)
+    print(f"Servidor simulado em {servidor.url}")
+    try:
+        servidor.servidor.serve_forever()
+    except KeyboardInterrupt:
+        servidor.fechar()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+# Suíte de benchmarks contra o servidor simulado (benchmarks/servidor_simulado.py), sem usar a API real.
+# Mede a latência de um turno completo, o tempo até o primeiro token no streaming, as requisições
+# por segundo com N simultâneas, a vazão sustentada numa rajada contra um limite de uso, a vazão
+# do tokenizador em textos grandes, a seleção do histórico numa conversa longa e o custo de
+# adicionar_mensagem_ui e da formatação das mensagens (Markdown e código) na interface.
+#   python benchmarks/suite.py [--saida resultado.json] [--comparar anterior.json] [--pular gui,tokenizador]
+# O resultado é impresso em JSON. Com --comparar, as métricas que pioraram mais que a tolerância
+# em relação a um resultado anterior são listadas e o código de saída é 1.
+import argparse  # Biblioteca para ler os argumentos da linha de comando.
+import json  # Biblioteca para imprimir e comparar os resultados.
+import os  # Biblioteca para montar o caminho do app.
+import platform  # Biblioteca para registrar a máquina onde o benchmark rodou.
+import random  # Biblioteca para variar o tamanho das mensagens.
+import shutil  # Biblioteca para apagar a pasta temporária dos dados.
+import subprocess  # Biblioteca para registrar a versão (commit) medida.
+import sys  # Biblioteca para ajustar o caminho de importação e o código de saída.
+import time  # Biblioteca para medir os tempos.
+from concurrent.futures import ThreadPoolExecutor  # Requisições simultâneas.
+
+raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, raiz)  # Permite importar nucleo.py e app.py da raiz.
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))  # E o servidor simulado.
+
+from servidor_simulado import ServidorSimulado  # Servidor local que imita a API.
+from comum import ms, isolar_dados, percentil  # Funções comuns aos benchmarks.
+
+# Métricas em que um valor maior é melhor; nas demais (tempos), menor é melhor.
+maior_melhor = {"requisicoes_por_segundo", "aproveitamento_limite", "mb_por_segundo", "tokens_por_segundo", "tokens_por_segundo_cliente"}
+
+def resumo(tempos):
+    return {
+        "medio_ms": ms(sum(tempos) / len(tempos)),
+        "p50_ms": ms(percentil(tempos, 50)),
+        "p95_ms": ms(percentil(tempos, 95)),
+        "max_ms": ms(max(tempos))
+    }
+
+def nova_requisicao(cliente_http, pergunta, streaming=False, ao_receber_trecho=None):
+    from nucleo import Requisicao
+    mensagens = [{"role": "user", "content": pergunta}]
+    return Requisicao(cliente_http, None, "gpt-3.5-turbo-16k", mensagens, 0.5, 4000, 20,
+                      streaming=streaming, ao_receber_trecho=ao_receber_trecho)  # Sem cache: toda requisição vai ao servidor.
+
+# Turnos completos, um depois do outro, sem streaming: do envio até a resposta inteira.
+def medir_latencia_turno(cliente_http, turnos):
+    tempos = []
+    for i in range(turnos):
+        inicio = time.perf_counter()
+        resposta, _ = nova_requisicao(cliente_http, f"Pergunta {i}").executar()
+        if resposta is None:
+            raise RuntimeError("o servidor simulado não respondeu")
+        tempos.append(time.perf_counter() - inicio)
+    return {"turnos": turnos, **resumo(tempos)}
+
+# Tempo até o primeiro trecho chegar no modo streaming, e a velocidade de recepção depois dele.
+def medir_primeiro_token(cliente_http, turnos):
+    primeiros, totais, tokens = [], [], 0
+    for i in range(turnos):
+        marcas = []
+        requisicao = nova_requisicao(cliente_http, f"Pergunta {i}", streaming=True,
+                                     ao_receber_trecho=lambda trecho: marcas.append(time.perf_counter()))
+        inicio = time.perf_counter()
+        resposta, _ = requisicao.executar()
+        fim = time.perf_counter()
+        if resposta is None or not marcas:
+            raise RuntimeError("o servidor simulado não respondeu")
+        primeiros.append(marcas[0] - inicio)
+        totais.append(fim - inicio)
+        tokens += len(marcas)
+    resultado = {"turnos": turnos, **resumo(primeiros), "total_medio_ms": ms(sum(totais) / len(totais))}
+    resultado["tokens_por_segundo_cliente"] = round(tokens / (sum(totais) - sum(primeiros)), 1)
+    return resultado
+
+# Requisições por segundo com um número fixo de requisições simultâneas.
+def medir_vazao(cliente_http, requisicoes, concorrencia):
+    def enviar(i):
+        resposta, _ = nova_requisicao(cliente_http, f"Pergunta {i}").executar()
+        return resposta is not None
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+        sucessos = sum(executor.map(enviar, range(requisicoes)))
+    duracao = time.perf_counter() - inicio
+    return {
+        "requisicoes": requisicoes,
+        "concorrencia": concorrencia,
+        "erros": requisicoes - sucessos,
+        "duracao_ms": ms(duracao),
+        "requisicoes_por_segundo": round(requisicoes / duracao, 1)
+    }
+
+# Rajada de requisições contra um servidor com limite de uso: mede a vazão sustentada e quantas
+# respostas 429 o servidor precisou mandar. O ideal é chegar perto do limite sem nenhum 429.
+def medir_rajada(requisicoes, concorrencia, limite, janela):
+    from nucleo import ClienteHTTP
+    servidor = ServidorSimulado(latencia=0.01, tokens_por_segundo=0, tokens_resposta=20,
+                                limite_requisicoes=limite, janela=janela).iniciar()
+    cliente_http = ClienteHTTP("chave-de-teste", link=servidor.url, compressao=False, tamanho_pool=concorrencia)  # Limitador próprio.
+    tempos = []
+    def enviar(i):
+        inicio = time.perf_counter()
+        resposta, _ = nova_requisicao(cliente_http, f"Pergunta {i}").executar()
+        tempos.append(time.perf_counter() - inicio)
+        return resposta is not None
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+        sucessos = sum(executor.map(enviar, range(requisicoes)))
+    duracao = time.perf_counter() - inicio
+    cliente_http.fechar()
+    servidor.fechar()
+    maximo = limite / janela  # Vazão máxima permitida pelo limite.
+    return {
+        "requisicoes": requisicoes,
+        "concorrencia": concorrencia,
+        "limite_por_janela": limite,
+        "janela_s": janela,
+        "erros": requisicoes - sucessos,
+        "respostas_429": servidor.servidor.recusadas,
+        "latencia": resumo(tempos),
+        "requisicoes_por_segundo": round(requisicoes / duracao, 2),
+        "aproveitamento_limite": round(requisicoes / duracao / maximo, 3) if requisicoes > limite else None
+    }
+
+# Vazão do tokenizador (encode) em um texto grande, do tamanho de uma conversa longa.
+def medir_tokenizador(tamanho_mb, repeticoes):
+    from nucleo import obter_tokenizador
+    random.seed(0)
+    palavras = "o modelo responde perguntas sobre código Python com exemplos e explicações detalhadas".split()
+    texto = ""
+    while len(texto) < tamanho_mb * 1024 * 1024:
+        texto += " ".join(random.choice(palavras) for _ in range(1000)) + "\n"
+    inicio = time.perf_counter()
+    tokenizador = obter_tokenizador()
+    carga = time.perf_counter() - inicio
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        quantidade = len(tokenizador.encode(texto, disallowed_special=()))
+        tempos.append(time.perf_counter() - inicio)
+    melhor = min(tempos)
+    return {
+        "bytes": len(texto.encode("utf-8")),
+        "tokens": quantidade,
+        "carga_tokenizador_ms": ms(carga),
+        **resumo(tempos),
+        "mb_por_segundo": round(len(texto.encode("utf-8")) / 1024 / 1024 / melhor, 2),
+        "tokens_por_segundo": round(quantidade / melhor)
+    }
+
+# Seleção do histórico numa conversa longa: custo de indexar cada mensagem, tempo de montar o
+# prompt e tamanho do prompt com e sem a busca dos turnos relevantes.
+def medir_recuperacao(turnos, consultas):
+    from nucleo import GerenciadorContexto
+    random.seed(0)
+    temas = ["python lista dicionário", "receita bolo chocolate", "viagem lisboa porto", "futebol campeonato tabela",
+             "sqlite índice consulta", "violão acordes escala", "impostos declaração prazo", "docker imagem container"]
+    mensagens = []
+    for i in range(turnos):
+        tema = random.choice(temas).split()
+        mensagens.append({"role": "user", "content": " ".join(random.choice(tema + ["como", "fazer", "melhor"]) for _ in range(30))})
+        mensagens.append({"role": "assistant", "content": " ".join(random.choice(tema + ["exemplo", "passo", "depois"]) for _ in range(150))})
+    perguntas = [{"role": "user", "content": f"me explique de novo {random.choice(temas)}"} for _ in range(consultas)]
+    resultado = {"turnos": turnos}
+    for nome, recuperacao in (("sem_recuperacao", False), ("com_recuperacao", True)):
+        contexto = GerenciadorContexto(recuperacao=recuperacao)
+        inicio = time.perf_counter()
+        for mensagem in mensagens:
+            contexto.adicionar(mensagem)
+        indexar = time.perf_counter() - inicio
+        contexto.contar_pendentes()  # A contagem de tokens é medida à parte (benchmark do tokenizador).
+        tempos, prompts = [], []
+        for pergunta in perguntas:
+            inicio = time.perf_counter()
+            prompts.append(contexto.montar("gpt-3.5-turbo-16k", extras=[pergunta])[1])
+            tempos.append(time.perf_counter() - inicio)
+        resultado[nome] = {"adicionar_mensagem_ms": ms(indexar / len(mensagens)), "montar": resumo(tempos),
+                           "tokens_prompt_medio": round(sum(prompts) / len(prompts))}
+    return resultado
+
+# Custo de adicionar_mensagem_ui: a chamada em si e o quadro desenhado logo depois. As respostas têm
+# Markdown e blocos de código; também são medidos a formatação de cada uma (feita no thread do
+# renderizador) e os quadros desenhados enquanto as mensagens formatadas entram na transcrição.
+def medir_gui(mensagens):
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")  # Roda sem tela, a menos que outra plataforma seja pedida.
+    import app  # Importa o módulo da aplicação.
+    from formatacao import formatar_markdown
+    from PyQt5.QtCore import Qt
+    from PyQt5.QtWidgets import QApplication
+
+    aplicacao = QApplication.instance() or QApplication(sys.argv)
+    app_chat = app.ChatApp()
+    app_chat.show()
+    app.configurar_aparencia(app_chat)
+    aplicacao.processEvents()
+    random.seed(0)
+    palavras = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor".split()
+    codigo = "def soma(a, b):  # Soma dois números.\n    return a + b * 2\n\nprint(soma(1, \"dois\"))\n"
+    chamadas, quadros, formatacoes = [], [], []
+    for i in range(mensagens):
+        texto = " ".join(random.choice(palavras) for _ in range(random.randint(5, 200)))
+        if i % 2:
+            texto = f"## Resposta {i}\n\n**{texto}**\n\n- item `um`\n- item dois\n\n```python\n{codigo * random.randint(1, 10)}```"
+            inicio = time.perf_counter()
+            formatar_markdown(texto)
+            formatacoes.append(time.perf_counter() - inicio)
+        inicio = time.perf_counter()
+        app_chat.adicionar_mensagem_ui("EU" if i % 2 == 0 else "GPT", texto, Qt.AlignRight if i % 2 == 0 else Qt.AlignLeft)
+        meio = time.perf_counter()
+        aplicacao.processEvents()  # Layout da nova mensagem e rolagem até o fim.
+        app_chat.resultados.viewport().repaint()
+        quadros.append(time.perf_counter() - meio)
+        chamadas.append(meio - inicio)
+    quadros_formatacao = []
+    for item in app_chat.transcricao.itens:
+        app_chat.renderizar(item)  # Formata todas de novo de uma vez, como ao abrir uma conversa longa.
+    limite = time.perf_counter() + 30
+    while (app_chat.renderizador.pendentes or app_chat.renderizados) and time.perf_counter() < limite:
+        inicio = time.perf_counter()
+        aplicacao.processEvents()  # Aplica um lote de mensagens formatadas.
+        app_chat.resultados.viewport().repaint()
+        quadros_formatacao.append(time.perf_counter() - inicio)
+    app_chat.close()
+    return {
+        "mensagens": mensagens,
+        "adicionar": resumo(chamadas),
+        "quadro": resumo(quadros),
+        "formatar": resumo(formatacoes),
+        "quadro_formatacao": resumo(quadros_formatacao or [0.0])
+    }
+
+def versao():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=raiz, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None  # Fora de um repositório git.
+
+# Percorre os dois resultados e lista as métricas que pioraram mais que a tolerância.
+def comparar(atual, anterior, tolerancia, caminho=""):
+    regressoes = []
+    for nome, valor in atual.items():
+        antigo = anterior.get(nome) if isinstance(anterior, dict) else None
+        if isinstance(valor, dict):
+            regressoes += comparar(valor, antigo or {}, tolerancia, f"{caminho}{nome}.")
+        elif isinstance(valor, (int, float)) and not isinstance(valor, bool) and isinstance(antigo, (int, float)) and antigo:
+            if not (nome.endswith("_ms") or nome in maior_melhor):
+                continue  # Parâmetros do benchmark (ex.: quantidade de turnos), não métricas.
+            variacao = (valor - antigo) / antigo
+            if nome in maior_melhor:
+                variacao = -variacao
+            if variacao > tolerancia:
+                regressoes.append({"metrica": caminho + nome, "anterior": antigo, "atual": valor,
+                                   "piora_percentual": round(variacao * 100, 1)})
+    return regressoes
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks do gptzinho contra um servidor simulado.")
+    parser.add_argument("--latencia", type=float, default=0.05, help="Latência (s) do servidor simulado até o primeiro byte.")
+    parser.add_argument("--tokens-por-segundo", type=float, default=200, help="Velocidade de geração do servidor simulado.")
+    parser.add_argument("--tokens-resposta", type=int, default=50, help="Tokens em cada resposta do servidor simulado.")
+    parser.add_argument("--turnos", type=int, default=20, help="Turnos medidos na latência e no primeiro token.")
+    parser.add_argument("--requisicoes", type=int, default=100, help="Requisições enviadas na medição de vazão.")
+    parser.add_argument("--concorrencia", type=int, default=8, help="Requisições simultâneas na medição de vazão.")
+    parser.add_argument("--requisicoes-rajada", type=int, default=60, help="Requisições da rajada contra o servidor com limite de uso.")
+    parser.add_argument("--limite-rajada", type=int, default=20, help="Requisições aceitas a cada 2 s pelo servidor da rajada.")
+    parser.add_argument("--tokenizador-mb", type=float, default=4, help="Tamanho (MB) do texto codificado.")
+    parser.add_argument("--turnos-recuperacao", type=int, default=2500, help="Turnos da conversa longa na medição da recuperação.")
+    parser.add_argument("--mensagens-gui", type=int, default=500, help="Mensagens adicionadas na medição da interface.")
+    parser.add_argument("--pular", default="", help="Benchmarks a pular, separados por vírgula (ex.: gui,tokenizador).")
+    parser.add_argument("--saida", help="Arquivo onde o resultado JSON também é gravado.")
+    parser.add_argument("--comparar", help="Resultado JSON anterior para comparar.")
+    parser.add_argument("--tolerancia", type=float, default=0.10, help="Piora aceita na comparação (0.10 = 10%%).")
+    args = parser.parse_args()
+    pular = {nome.strip() for nome in args.pular.split(",") if nome.strip()}
+    pasta_dados = isolar_dados()  # Antes de qualquer importação do app ou do núcleo.
+
+    resultado = {
+        "versao": versao(),
+        "data": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "servidor": {"latencia_s": args.latencia, "tokens_por_segundo": args.tokens_por_segundo,
+                     "tokens_resposta": args.tokens_resposta},  # Configuração do servidor simulado.
+        "benchmarks": {}
+    }
+    benchmarks = resultado["benchmarks"]
+    servidor = ServidorSimulado(latencia=args.latencia, tokens_por_segundo=args.tokens_por_segundo,
+                                tokens_resposta=args.tokens_resposta).iniciar()
+    from nucleo import ClienteHTTP
+    cliente_http = ClienteHTTP("chave-de-teste", link=servidor.url, compressao=False, tamanho_pool=max(args.concorrencia, 10))
+
+    medicoes = [
+        ("latencia_turno", lambda: medir_latencia_turno(cliente_http, args.turnos)),
+        ("primeiro_token", lambda: medir_primeiro_token(cliente_http, args.turnos)),
+        ("vazao", lambda: medir_vazao(cliente_http, args.requisicoes, args.concorrencia)),
+        ("rajada", lambda: medir_rajada(args.requisicoes_rajada, args.concorrencia * 2, args.limite_rajada, 2.0)),
+        ("tokenizador", lambda: medir_tokenizador(args.tokenizador_mb, 3)),
+        ("recuperacao", lambda: medir_recuperacao(args.turnos_recuperacao, 50)),
+        ("gui", lambda: medir_gui(args.mensagens_gui))
+    ]
+    for nome, medir in medicoes:
+        if nome in pular:
+            continue
+        try:
+            benchmarks[nome] = medir()
+        except Exception as e:  # Ex.: PyQt5 ou as tabelas do tiktoken indisponíveis; os outros benchmarks seguem.
+            benchmarks[nome] = {"erro": f"{type(e).__name__}: {e}"}
+        print(f"{nome}: {benchmarks[nome].get('erro', 'ok')}", file=sys.stderr)  # Progresso fora do JSON.
+    cliente_http.fechar()
+    servidor.fechar()
+    shutil.rmtree(pasta_dados, ignore_errors=True)
+
+    codigo = 0
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as arquivo:
+            anterior = json.load(arquivo)
+        resultado["comparacao"] = {
+            "anterior": anterior.get("versao"),
+            "tolerancia": args.tolerancia,
+            "regressoes": comparar(resultado["benchmarks"], anterior.get("benchmarks", {}), args.tolerancia)
+        }
+        codigo = 1 if resultado["comparacao"]["regressoes"] else 0
+    if any("erro" in medicao for medicao in benchmarks.values()):
+        codigo = 1
+    saida = json.dumps(resultado, indent=2, ensure_ascii=False)
+    print(saida)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as arquivo:
+            arquivo.write(saida + "\n")
+    return codigo
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+# Mede o custo da transcrição virtualizada com muitas mensagens: tempo para carregar as
+# mensagens e tempo de cada quadro ao rolar a lista de cima a baixo.
+#   python benchmarks/transcricao.py [--mensagens 10000] [--quadros 600]
+# O resultado é impresso em JSON; o código de saída é 1 se o p95 dos quadros passar de 16,7 ms (60 fps).
+import argparse  # Biblioteca para ler os argumentos da linha de comando.
+import json  # Biblioteca para imprimir o resultado.
+import os  # Biblioteca para montar o caminho do app.
+import random  # Biblioteca para variar o tamanho das mensagens.
+import shutil  # Biblioteca para apagar a pasta temporária dos dados.
+import sys  # Biblioteca para ajustar o caminho de importação e o código de saída.
+import time  # Biblioteca para medir os tempos.
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Permite importar app.py da raiz.
+
+from comum import ms, isolar_dados, percentil  # Funções comuns aos benchmarks (da pasta deste script).
+
+def main():
+    parser = argparse.ArgumentParser(description="Mede a rolagem da transcrição com muitas mensagens.")
+    parser.add_argument("--mensagens", type=int, default=10000, help="Quantidade de mensagens carregadas.")
+    parser.add_argument("--quadros", type=int, default=600, help="Quantidade de quadros medidos na rolagem.")
+    args = parser.parse_args()
+
+    pasta_dados = isolar_dados()
+    import app  # Importa o módulo da aplicação.
+    from PyQt5.QtCore import Qt
+    from PyQt5.QtWidgets import QApplication
+
+    aplicacao = QApplication(sys.argv)
+    app_chat = app.ChatApp()
+    app_chat.show()
+    app.configurar_aparencia(app_chat)
+    aplicacao.processEvents()
+
+    random.seed(0)
+    palavras = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor".split()
+    inicio = time.perf_counter()
+    for i in range(args.mensagens):
+        texto = " ".join(random.choice(palavras) for _ in range(random.randint(5, 200)))
+        if i % 2 == 0:
+            app_chat.adicionar_mensagem_ui("EU", texto, Qt.AlignRight)
+        else:
+            app_chat.adicionar_mensagem_ui("GPT", texto, Qt.AlignLeft)
+    tempo_adicionar = time.perf_counter() - inicio
+    barra = app_chat.resultados.verticalScrollBar()
+    inicio = time.perf_counter()
+    ultima = app_chat.transcricao.index(args.mensagens - 1)
+    while not app_chat.resultados.visualRect(ultima).isValid():  # As alturas são calculadas em lotes pelo loop de eventos.
+        aplicacao.processEvents()
+    tempo_layout = time.perf_counter() - inicio
+
+    passo = max(barra.maximum() // args.quadros, 1)
+    quadros = []
+    for i in range(args.quadros):
+        inicio = time.perf_counter()
+        barra.setValue(i * passo)
+        app_chat.resultados.viewport().repaint()  # Desenha o quadro na hora, como o loop faria.
+        quadros.append(time.perf_counter() - inicio)
+    app_chat.close()
+    shutil.rmtree(pasta_dados, ignore_errors=True)
+
+    resultado = {
+        "mensagens": args.mensagens,
+        "adicionar_ms": ms(tempo_adicionar),
+        "layout_inicial_ms": ms(tempo_layout),
+        "quadro_medio_ms": ms(sum(quadros) / len(quadros)),
+        "quadro_p95_ms": ms(percentil(quadros, 95)),
+        "quadro_max_ms": ms(max(quadros)),
+        "fps_medio": round(len(quadros) / sum(quadros), 1),
+        "meta_quadro_ms": 16.7
+    }
+    resultado["dentro_da_meta"] = resultado["quadro_p95_ms"] <= resultado["meta_quadro_ms"]
+    print(json.dumps(resultado, indent=2))
+    return 0 if resultado["dentro_da_meta"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
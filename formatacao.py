@@ -0,0 +1,183 @@
+# Converte o texto das mensagens (Markdown) em HTML seguro para a transcrição, sem dependência do Qt.
+# Todo o texto vindo do modelo é escapado antes de qualquer formatação, então uma resposta com
+# "<" ou tags HTML aparece como texto. Suporta títulos, listas, citações, negrito, itálico, links,
+# código em linha e blocos de código com destaque de sintaxe simples (palavras-chave, textos,
+# números e comentários). É usado pelo RenderizadorMensagens, em um thread separado da interface.
+import html  # Biblioteca para escapar o texto.
+import re  # Biblioteca para reconhecer a marcação Markdown e os elementos do código.
+import threading  # Biblioteca para proteger o cache usado por mais de um thread.
+from collections import OrderedDict  # Cache LRU das mensagens já formatadas.
+
+# Cores do destaque de sintaxe, no tema escuro da janela.
+cores_codigo = {
+    "comentario": "#6a9955",
+    "texto": "#ce9178",
+    "numero": "#b5cea8",
+    "palavra": "#569cd6"
+}
+cor_fundo_codigo = "#2b2b2b"  # Fundo dos blocos de código.
+
+# Palavras-chave das linguagens mais comuns nas respostas (Python, JavaScript, C/Java, SQL, shell).
+palavras_chave = set("""
+and as assert async await break case catch class const continue def default del do elif else enum except export
+extends false final finally fn for from func function if implements import in interface is lambda let match new
+nil none not null or package pass private protected pub public raise return self static struct super switch this
+throw true try type use using var void while with yield int float double char bool boolean string long
+select insert update delete into values where join left right inner outer on group order by having limit create
+table drop alter index distinct union echo then fi done esac local
+""".split())
+
+# Comentários de cada família de linguagens.
+comentarios_hash = r"#[^\n]*"
+comentarios_c = r"//[^\n]*|/\*.*?\*/"
+comentarios_sql = r"--[^\n]*"
+linguagens_hash = {"python", "py", "bash", "sh", "shell", "zsh", "ruby", "rb", "yaml", "yml", "toml", "r", "perl",
+                   "dockerfile", "makefile", "powershell", "ps1", "ini", "conf"}
+linguagens_sql = {"sql", "sqlite", "postgresql", "mysql", "lua", "haskell"}
+
+padroes_codigo = {}  # Expressão de destaque já compilada, por tipo de comentário.
+
+def padrao_codigo(linguagem):
+    linguagem = linguagem.lower()
+    if linguagem in linguagens_hash:
+        comentario = comentarios_hash
+    elif linguagem in linguagens_sql:
+        comentario = comentarios_sql
+    elif linguagem:
+        comentario = comentarios_c
+    else:
+        comentario = f"{comentarios_hash}|{comentarios_c}"  # Linguagem não informada.
+    if comentario not in padroes_codigo:
+        padroes_codigo[comentario] = re.compile(
+            rf"(?P<comentario>{comentario})"
+            r"|(?P<texto>\"(?:\\.|[^\"\\\n])*\"|'(?:\\.|[^'\\\n])*')"
+            r"|(?P<numero>\b\d+(?:\.\d+)?\b)"
+            r"|(?P<palavra>\b[A-Za-z_]\w*\b)", re.S)
+    return padroes_codigo[comentario]
+
+# Escapa o código e colore palavras-chave, textos, números e comentários.
+def destacar_codigo(codigo, linguagem=""):
+    partes = []
+    posicao = 0
+    for achado in padrao_codigo(linguagem).finditer(codigo):
+        tipo = achado.lastgroup
+        if tipo == "palavra" and achado.group().lower() not in palavras_chave:
+            continue  # Identificador comum: fica sem cor.
+        partes.append(html.escape(codigo[posicao:achado.start()]))
+        partes.append(f'<span style="color: {cores_codigo[tipo]};">{html.escape(achado.group())}</span>')
+        posicao = achado.end()
+    partes.append(html.escape(codigo[posicao:]))
+    return "".join(partes)
+
+def bloco_codigo(linhas, linguagem):
+    codigo = destacar_codigo("\n".join(linhas), linguagem)
+    rotulo = f'<span style="color: #9d9d9d;">{html.escape(linguagem)}</span><br>' if linguagem else ""
+    return (f'<table width="100%" cellpadding="6" bgcolor="{cor_fundo_codigo}"><tr><td>{rotulo}'
+            f'<pre style="font-family: monospace;">{codigo}</pre></td></tr></table>')
+
+# Formatação dentro de uma linha: código, links, negrito e itálico. O texto já vem escapado.
+def formatar_linha(texto):
+    codigos = []
+
+    def guardar_codigo(achado):
+        codigos.append(f'<code style="background-color: {cor_fundo_codigo};">{achado.group(1)}</code>')
+        return f"\x00{len(codigos) - 1}\x00"  # O conteúdo do código não recebe outras formatações.
+
+    texto = re.sub(r"`([^`]+)`", guardar_codigo, texto)
+    texto = re.sub(r"\[([^\]]+)\]\((https?://[^\s)]+)\)", r'<a href="\2">\1</a>', texto)
+    texto = re.sub(r"\*\*(.+?)\*\*|__(.+?)__", lambda a: f"<b>{a.group(1) or a.group(2)}</b>", texto)
+    texto = re.sub(r"(?<![\w*])\*(?!\s)(.+?)(?<!\s)\*(?![\w*])", r"<i>\1</i>", texto)
+    return re.sub(r"\x00(\d+)\x00", lambda a: codigos[int(a.group(1))], texto)
+
+# Converte o texto de uma mensagem em HTML. Um bloco de código ainda aberto (resposta em
+# streaming) é exibido como código até o fim do texto.
+def formatar_markdown(texto):
+    texto = texto.replace("\x00", "\ufffd")  # O caractere nulo marca o código em linha em formatar_linha.
+    blocos = []  # Partes do HTML final.
+    paragrafo = []  # Linhas do parágrafo atual.
+    lista = None  # ("ul" ou "ol", itens) da lista atual.
+
+    def fechar_paragrafo():
+        if paragrafo:
+            blocos.append("<p>" + "<br>".join(formatar_linha(html.escape(linha)) for linha in paragrafo) + "</p>")
+            paragrafo.clear()
+
+    def fechar_lista():
+        nonlocal lista
+        if lista:
+            tipo, itens = lista
+            blocos.append(f"<{tipo}>" + "".join(f"<li>{item}</li>" for item in itens) + f"</{tipo}>")
+            lista = None
+
+    linhas = texto.split("\n")
+    i = 0
+    while i < len(linhas):
+        linha = linhas[i]
+        cerca = re.match(r"^\s*(```|~~~)\s*([\w+#.-]*)", linha)
+        if cerca:  # Bloco de código até a cerca de fechamento (ou até o fim do texto).
+            fechar_paragrafo()
+            fechar_lista()
+            codigo = []
+            i += 1
+            while i < len(linhas) and not linhas[i].strip().startswith(cerca.group(1)):
+                codigo.append(linhas[i])
+                i += 1
+            blocos.append(bloco_codigo(codigo, cerca.group(2)))
+            i += 1
+            continue
+        titulo = re.match(r"^(#{1,6})\s+(.*)$", linha)
+        item_lista = re.match(r"^\s*(?:([-*+])|(\d+)[.)])\s+(.*)$", linha)
+        if not linha.strip():
+            fechar_paragrafo()
+            fechar_lista()
+        elif titulo:
+            fechar_paragrafo()
+            fechar_lista()
+            nivel = min(len(titulo.group(1)) + 2, 6)  # Títulos menores, do tamanho de uma mensagem de chat.
+            blocos.append(f"<h{nivel}>{formatar_linha(html.escape(titulo.group(2)))}</h{nivel}>")
+        elif re.match(r"^\s*([-*_])(\s*\1){2,}\s*$", linha):
+            fechar_paragrafo()
+            fechar_lista()
+            blocos.append("<hr>")
+        elif item_lista:
+            fechar_paragrafo()
+            tipo = "ul" if item_lista.group(1) else "ol"
+            if lista is None or lista[0] != tipo:
+                fechar_lista()
+                lista = (tipo, [])
+            lista[1].append(formatar_linha(html.escape(item_lista.group(3))))
+        elif linha.startswith(">"):
+            fechar_paragrafo()
+            fechar_lista()
+            blocos.append(f'<blockquote style="color: #b0b0b0;">{formatar_linha(html.escape(linha.lstrip("> ")))}</blockquote>')
+        else:
+            fechar_lista()
+            paragrafo.append(linha)
+        i += 1
+    fechar_paragrafo()
+    fechar_lista()
+    return "".join(blocos)
+
+# Formata mensagens guardando o resultado de cada texto (LRU): mensagens repetidas, recarregadas
+# do banco ou exibidas de novo não são formatadas outra vez.
+class FormatadorMensagens:
+    def __init__(self, max_mensagens=1000):
+        self.max_mensagens = max_mensagens  # Quantas mensagens formatadas ficam no cache.
+        self.cache = OrderedDict()  # Texto -> HTML.
+        self.trava = threading.Lock()
+
+    # Com cachear=False (texto parcial de uma resposta em streaming), o resultado não entra no cache.
+    def formatar(self, texto, cachear=True):
+        with self.trava:
+            resultado = self.cache.get(texto)
+            if resultado is not None:
+                self.cache.move_to_end(texto)
+                return resultado
+        resultado = formatar_markdown(texto)
+        if not cachear:
+            return resultado
+        with self.trava:
+            self.cache[texto] = resultado
+            if len(self.cache) > self.max_mensagens:
+                self.cache.popitem(last=False)  # Descarta a mensagem usada há mais tempo.
+        return resultado
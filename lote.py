@@ -0,0 +1,154 @@
+# Modo em lote, sem interface gráfica: lê um arquivo JSONL de perguntas, envia-as à API
+# com N requisições simultâneas e grava cada resultado assim que fica pronto.
+#   python app.py --batch entrada.jsonl --out saida.jsonl [--concorrencia 4]
+#
+# Cada linha da entrada é um objeto JSON com "prompt" (texto) ou "messages" (lista no formato
+# da API), e opcionalmente "id", "model", "temperature" e "user" (a quem o custo é atribuído nas
+# métricas). Sem "id", usa o número da linha.
+# Se o processo cair, basta rodar de novo: os ids que já têm resposta na saída são pulados.
+import argparse  # Biblioteca para ler os argumentos da linha de comando.
+import json  # Biblioteca para ler e gravar as linhas JSONL.
+import os  # Biblioteca para verificar o arquivo de saída.
+import sys  # Biblioteca para o código de saída e mensagens de progresso.
+import time  # Biblioteca para medir a espera de cada pergunta na fila.
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED  # Requisições simultâneas.
+from nucleo import chave_api, max_requisicoes_simultaneas, ClienteHTTP, CacheRespostas, GerenciadorContexto, Requisicao
+from metricas import usuario_padrao, RegistroMetricas
+
+# Lê os ids que já têm resposta no arquivo de saída (linhas com erro são tentadas de novo).
+def ids_concluidos(caminho_saida):
+    concluidos = set()
+    if not os.path.exists(caminho_saida):
+        return concluidos
+    with open(caminho_saida, encoding="utf-8") as arquivo:
+        for linha in arquivo:
+            try:
+                resultado = json.loads(linha)
+            except ValueError:
+                continue  # Linha cortada por uma queda no meio da gravação.
+            if "error" not in resultado:
+                concluidos.add(str(resultado.get("id")))
+    return concluidos
+
+# Lê as perguntas do arquivo uma a uma, sem carregar o arquivo inteiro na memória. Uma linha que
+# não é um objeto JSON vira um item com "error", gravado na saída sem interromper o lote.
+def ler_perguntas(caminho_entrada):
+    with open(caminho_entrada, encoding="utf-8", errors="replace") as arquivo:
+        for numero, linha in enumerate(arquivo, start=1):
+            if not linha.strip():
+                continue
+            try:
+                item = json.loads(linha)
+            except ValueError as e:
+                item = None
+                erro = f"Linha {numero} inválida: {e}"
+            else:
+                erro = f"Linha {numero} inválida: esperado um objeto JSON"
+            if not isinstance(item, dict):
+                print(erro, file=sys.stderr)
+                yield {"id": numero, "error": erro}
+                continue
+            item.setdefault("id", numero)
+            yield item
+
+# Envia uma pergunta e devolve a linha de resultado. Qualquer falha (ex.: mensagem sem "content")
+# vira uma linha com "error", para as outras perguntas do lote seguirem.
+def processar(item, cliente_http, cache, modelo_padrao, temperatura_padrao, metricas=None, enfileirada_em=None):
+    try:
+        return responder(item, cliente_http, cache, modelo_padrao, temperatura_padrao, metricas, enfileirada_em)
+    except Exception as e:
+        return {"id": item["id"], "model": item.get("model", modelo_padrao), "error": f"{type(e).__name__}: {e}"}
+
+def responder(item, cliente_http, cache, modelo_padrao, temperatura_padrao, metricas, enfileirada_em):
+    modelo = item.get("model", modelo_padrao)
+    temperatura = item.get("temperature", temperatura_padrao)
+    mensagens = item.get("messages") or [{"role": "user", "content": item.get("prompt", "")}]
+    # Ajusta as mensagens ao contexto do modelo e calcula o max_tokens. As mensagens da entrada são
+    # enviadas como vieram, sem a seleção por relevância usada nas conversas longas da interface.
+    contexto = GerenciadorContexto(recuperacao=False)
+    for mensagem in mensagens[:-1]:
+        contexto.adicionar(mensagem)
+    mensagens, tokens_prompt, max_tokens = contexto.montar(modelo, extras=mensagens[-1:])
+    requisicao = Requisicao(cliente_http, cache, modelo, mensagens, temperatura, max_tokens, tokens_prompt,
+                            metricas=metricas, usuario=item.get("user", usuario_padrao), enfileirada_em=enfileirada_em)
+    resposta, _ = requisicao.executar()
+    if resposta is None:
+        return {"id": item["id"], "model": modelo, "error": requisicao.erro}
+    return {
+        "id": item["id"],
+        "model": modelo,
+        "content": resposta['choices'][0]['message']['content'],
+        "usage": resposta.get('usage', {}),
+        "cached": bool(resposta.get('cache'))
+    }
+
+# Processa o arquivo de entrada e acrescenta os resultados à saída. Retorna (respondidas, erros, puladas).
+def processar_lote(caminho_entrada, caminho_saida, concorrencia=max_requisicoes_simultaneas,
+                   modelo="gpt-3.5-turbo-16k", temperatura=0.5, metricas=None):
+    concluidos = ids_concluidos(caminho_saida)
+    cliente_http = ClienteHTTP(chave_api, tamanho_pool=max(concorrencia, 10))  # Uma conexão por requisição simultânea.
+    cache = CacheRespostas()
+    respondidas = erros = puladas = 0
+    if os.path.exists(caminho_saida) and os.path.getsize(caminho_saida):
+        with open(caminho_saida, "rb") as arquivo:
+            arquivo.seek(-1, os.SEEK_END)
+            termina_com_quebra = arquivo.read(1) == b"\n"
+    else:
+        termina_com_quebra = True
+    with open(caminho_saida, "a", encoding="utf-8") as saida, ThreadPoolExecutor(max_workers=concorrencia) as executor:
+        if not termina_com_quebra:
+            saida.write("\n")  # Isola a última linha, cortada por uma queda anterior.
+        pendentes = set()
+
+        # Grava um resultado assim que fica pronto.
+        def gravar_resultado(resultado):
+            nonlocal respondidas, erros
+            saida.write(json.dumps(resultado, ensure_ascii=False) + "\n")
+            saida.flush()  # Cada resultado vai para o disco assim que chega.
+            if "error" in resultado:
+                erros += 1
+            else:
+                respondidas += 1
+
+        def gravar(prontos):
+            for futuro in prontos:
+                gravar_resultado(futuro.result())
+
+        for item in ler_perguntas(caminho_entrada):
+            if str(item["id"]) in concluidos:
+                puladas += 1
+                continue
+            if "error" in item:  # Linha inválida da entrada.
+                gravar_resultado(item)
+                continue
+            if len(pendentes) >= concorrencia * 2:  # Não lê a entrada muito à frente do que já foi enviado.
+                prontos, pendentes = wait(pendentes, return_when=FIRST_COMPLETED)
+                gravar(prontos)
+            pendentes.add(executor.submit(processar, item, cliente_http, cache, modelo, temperatura,
+                                          metricas, time.perf_counter()))
+        while pendentes:
+            prontos, pendentes = wait(pendentes, return_when=FIRST_COMPLETED)
+            gravar(prontos)
+    cliente_http.fechar()
+    return respondidas, erros, puladas
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Envia em lote as perguntas de um arquivo JSONL.")
+    parser.add_argument("--batch", dest="entrada", required=True, help="Arquivo JSONL com as perguntas.")
+    parser.add_argument("--out", dest="saida", required=True, help="Arquivo JSONL onde os resultados são acrescentados.")
+    parser.add_argument("--concorrencia", type=int, default=max_requisicoes_simultaneas, help="Requisições simultâneas.")
+    parser.add_argument("--modelo", default="gpt-3.5-turbo-16k", help="Modelo usado quando a linha não informa \"model\".")
+    parser.add_argument("--temperatura", type=float, default=0.5, help="Temperatura usada quando a linha não informa \"temperature\".")
+    args = parser.parse_args(argv)
+    metricas = RegistroMetricas()
+    respondidas, erros, puladas = processar_lote(args.entrada, args.saida, args.concorrencia, args.modelo, args.temperatura, metricas)
+    metricas.fechar()
+    print(f"{respondidas} respondidas, {erros} com erro, {puladas} já concluídas antes", file=sys.stderr)
+    resumo = metricas.resumo()
+    if resumo["latencia_ms"]:
+        print(f"Latência p50 {resumo['latencia_ms']['p50']:.0f} ms, p95 {resumo['latencia_ms']['p95']:.0f} ms; "
+              f"custo estimado US$ {resumo['custo_usd']:.4f}", file=sys.stderr)
+    return 1 if erros else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
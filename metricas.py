@@ -0,0 +1,154 @@
+# Métricas de cada requisição, sem dependência do Qt: espera na fila e pelos limites de uso,
+# abertura da conexão, tempo até o primeiro byte, latência total, tokens do prompt e da resposta,
+# modelo, status HTTP, tentativas e custo estimado. Os registros recentes são agregados em percentis móveis e podem
+# ser gravados em um arquivo JSONL (um registro por linha) e/ou em um arquivo de texto no
+# formato do Prometheus (lido pelo node_exporter com o textfile collector, por exemplo).
+import os  # Biblioteca para ler a configuração e gravar os arquivos.
+import json  # Biblioteca para gravar os registros em JSONL.
+import getpass  # Biblioteca para identificar o usuário.
+import threading  # Biblioteca para sincronizar os registros vindos de vários threads.
+import time  # Biblioteca para controlar a gravação do arquivo do Prometheus.
+from collections import deque  # Janela com os registros mais recentes.
+from dotenv import load_dotenv  # Biblioteca para carregar variáveis de ambiente de um arquivo .env.
+
+load_dotenv()  # Carrega as variáveis de ambiente do arquivo .env.
+arquivo_jsonl = os.getenv('METRICAS_JSONL')  # Arquivo onde cada requisição é acrescentada (opcional).
+arquivo_prometheus = os.getenv('METRICAS_PROMETHEUS')  # Arquivo de texto no formato do Prometheus (opcional).
+janela_percentis = int(os.getenv('METRICAS_JANELA', "500"))  # Quantidade de requisições recentes nos percentis.
+
+def usuario_sistema():
+    try:
+        return getpass.getuser()
+    except (KeyError, OSError):  # Sem USER/LOGNAME e sem entrada no passwd (ex.: alguns contêineres).
+        return "desconhecido"
+
+usuario_padrao = os.getenv('METRICAS_USUARIO') or usuario_sistema()  # Usuário a quem o gasto é atribuído.
+
+# Preço estimado (US$ por 1000 tokens) do prompt e da resposta de cada modelo.
+precos_modelos = {
+    "gpt-3.5-turbo-16k": (0.003, 0.004),
+    "gpt-4-0613": (0.03, 0.06),
+    "gpt-4": (0.03, 0.06)
+}
+
+def estimar_custo(modelo, tokens_prompt, tokens_resposta):
+    preco_prompt, preco_resposta = precos_modelos.get(modelo, (0.0, 0.0))  # Modelo sem preço conhecido: custo 0.
+    return (tokens_prompt * preco_prompt + tokens_resposta * preco_resposta) / 1000
+
+# Tempos agregados em percentis (todos em milissegundos).
+campos_tempo = ("espera_fila_ms", "espera_limite_ms", "conexao_ms", "ttfb_ms", "primeiro_trecho_ms", "latencia_ms")
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(int(len(ordenados) * p / 100), len(ordenados) - 1)]
+
+# Escapa um valor de rótulo como o formato de texto do Prometheus exige (\\, " e quebra de linha).
+def escapar_rotulo(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+# Recebe os registros das requisições (de qualquer thread), guarda os mais recentes para os
+# percentis, soma os totais por modelo e por usuário e grava os arquivos configurados.
+class RegistroMetricas:
+    def __init__(self, janela=janela_percentis, caminho_jsonl=arquivo_jsonl, caminho_prometheus=arquivo_prometheus,
+                 intervalo_prometheus=1.0):
+        self.recentes = deque(maxlen=janela)  # Registros usados nos percentis móveis.
+        self.por_modelo = {}  # Totais de cada modelo: requisições, erros, tokens e custo.
+        self.por_usuario = {}  # Custo e requisições de cada usuário.
+        self.por_status = {}  # Requisições por modelo e status HTTP, para o Prometheus.
+        self.totais_tempo = {campo: [0.0, 0] for campo in campos_tempo}  # Soma e quantidade acumuladas de cada tempo (_sum e _count).
+        self.caminho_jsonl = caminho_jsonl
+        self.caminho_prometheus = caminho_prometheus
+        self.intervalo_prometheus = intervalo_prometheus  # Intervalo mínimo (s) entre duas gravações do arquivo.
+        self.gravado_em = 0.0  # Última gravação do arquivo do Prometheus.
+        self.arquivo = None  # Arquivo JSONL, aberto no primeiro registro.
+        self.trava = threading.Lock()
+
+    def registrar(self, registro):
+        with self.trava:
+            self.recentes.append(registro)
+            totais = self.por_modelo.setdefault(registro["modelo"], {
+                "requisicoes": 0, "erros": 0, "tokens_prompt": 0, "tokens_resposta": 0, "custo_usd": 0.0})
+            totais["requisicoes"] += 1
+            totais["erros"] += 1 if registro.get("erro") else 0
+            totais["tokens_prompt"] += registro.get("tokens_prompt", 0)
+            totais["tokens_resposta"] += registro.get("tokens_resposta", 0)
+            totais["custo_usd"] += registro.get("custo_usd", 0.0)
+            usuario = self.por_usuario.setdefault(registro.get("usuario", usuario_padrao), {"requisicoes": 0, "custo_usd": 0.0})
+            usuario["requisicoes"] += 1
+            usuario["custo_usd"] += registro.get("custo_usd", 0.0)
+            chave_status = (registro["modelo"], str(registro.get("status")))
+            self.por_status[chave_status] = self.por_status.get(chave_status, 0) + 1
+            for campo in campos_tempo:
+                if registro.get(campo) is not None:
+                    self.totais_tempo[campo][0] += registro[campo]
+                    self.totais_tempo[campo][1] += 1
+            if self.caminho_jsonl:
+                if self.arquivo is None:
+                    os.makedirs(os.path.dirname(os.path.abspath(self.caminho_jsonl)), exist_ok=True)
+                    self.arquivo = open(self.caminho_jsonl, "a", encoding="utf-8")
+                self.arquivo.write(json.dumps(registro, ensure_ascii=False) + "\n")
+                self.arquivo.flush()  # Cada registro vai para o disco assim que chega.
+            if self.caminho_prometheus and time.monotonic() - self.gravado_em >= self.intervalo_prometheus:
+                self.gravar_prometheus()
+
+    # Percentis de um campo de tempo nos registros recentes, ou None se nenhum registro tem o campo.
+    def percentis(self, campo, ps=(50, 95, 99)):
+        with self.trava:
+            valores = [r[campo] for r in self.recentes if r.get(campo) is not None]
+        if not valores:
+            return None
+        return {f"p{p}": percentil(valores, p) for p in ps}
+
+    def resumo(self):
+        resultado = {campo: self.percentis(campo) for campo in campos_tempo}
+        with self.trava:
+            resultado["requisicoes"] = sum(t["requisicoes"] for t in self.por_modelo.values())
+            resultado["erros"] = sum(t["erros"] for t in self.por_modelo.values())
+            resultado["custo_usd"] = sum(t["custo_usd"] for t in self.por_modelo.values())
+            resultado["por_modelo"] = {modelo: dict(totais) for modelo, totais in self.por_modelo.items()}
+            resultado["por_usuario"] = {usuario: dict(totais) for usuario, totais in self.por_usuario.items()}
+        return resultado
+
+    # Grava o arquivo do Prometheus de uma vez (arquivo temporário + troca), para nunca ser lido pela metade.
+    # Deve ser chamado com a trava já adquirida.
+    def gravar_prometheus(self):
+        linhas = [
+            "# HELP gptzinho_requisicoes_total Requisições à API por modelo e status HTTP.",
+            "# TYPE gptzinho_requisicoes_total counter"
+        ]
+        for (modelo, status), quantidade in sorted(self.por_status.items()):
+            linhas.append(f'gptzinho_requisicoes_total{{modelo="{escapar_rotulo(modelo)}",status="{escapar_rotulo(status)}"}} {quantidade}')
+        linhas += ["# HELP gptzinho_tokens_total Tokens usados por modelo.", "# TYPE gptzinho_tokens_total counter"]
+        for modelo, totais in sorted(self.por_modelo.items()):
+            linhas.append(f'gptzinho_tokens_total{{modelo="{escapar_rotulo(modelo)}",tipo="prompt"}} {totais["tokens_prompt"]}')
+            linhas.append(f'gptzinho_tokens_total{{modelo="{escapar_rotulo(modelo)}",tipo="resposta"}} {totais["tokens_resposta"]}')
+        linhas += ["# HELP gptzinho_custo_usd_total Custo estimado em dólares por usuário.", "# TYPE gptzinho_custo_usd_total counter"]
+        for usuario, totais in sorted(self.por_usuario.items()):
+            linhas.append(f'gptzinho_custo_usd_total{{usuario="{escapar_rotulo(usuario)}"}} {totais["custo_usd"]:.6f}')
+        for campo in campos_tempo:
+            valores = [r[campo] for r in self.recentes if r.get(campo) is not None]
+            if not valores:
+                continue
+            nome = f"gptzinho_{campo[:-len('_ms')]}_segundos"
+            linhas += [f"# HELP {nome} Percentis móveis das últimas {len(valores)} requisições; soma e quantidade desde o início.",
+                       f"# TYPE {nome} summary"]
+            for p in (50, 95, 99):
+                linhas.append(f'{nome}{{quantile="{p / 100}"}} {percentil(valores, p) / 1000:.6f}')
+            soma, quantidade = self.totais_tempo[campo]
+            linhas.append(f"{nome}_sum {soma / 1000:.6f}")  # Acumulados: o Prometheus espera contadores que só crescem.
+            linhas.append(f"{nome}_count {quantidade}")
+        os.makedirs(os.path.dirname(os.path.abspath(self.caminho_prometheus)), exist_ok=True)
+        temporario = self.caminho_prometheus + ".tmp"
+        with open(temporario, "w", encoding="utf-8") as arquivo:
+            arquivo.write("\n".join(linhas) + "\n")
+        os.replace(temporario, self.caminho_prometheus)
+        self.gravado_em = time.monotonic()
+
+    # Grava o arquivo do Prometheus com os últimos registros e fecha o JSONL.
+    def fechar(self):
+        with self.trava:
+            if self.caminho_prometheus and self.por_modelo:
+                self.gravar_prometheus()
+            if self.arquivo is not None:
+                self.arquivo.close()
+                self.arquivo = None
@@ -0,0 +1,754 @@
+# Núcleo da aplicação, sem dependência do Qt: configuração, tokenizador, cliente HTTP,
+# cache de respostas, montagem do contexto e envio das requisições à API.
+# É usado tanto pela interface (app.py) quanto pelo modo em lote (lote.py).
+# tiktoken e requests são importados só quando usados, para a janela abrir mais rápido.
+import os  # Biblioteca para interagir com o sistema de arquivos.
+import json  # Biblioteca para decodificar os eventos do streaming.
+import threading  # Biblioteca para sincronizar o acesso compartilhado entre threads.
+import socket  # Biblioteca para interromper conexões ao cancelar uma requisição.
+import hashlib  # Biblioteca para gerar as chaves do cache de respostas.
+import random  # Biblioteca para sortear o tempo de espera entre as tentativas (jitter).
+import re  # Biblioteca para ler as durações dos cabeçalhos de limite de uso.
+import time  # Biblioteca para controlar a validade das respostas em cache e medir as requisições.
+from collections import deque  # Janela das requisições enviadas no último minuto.
+from dotenv import load_dotenv  # Biblioteca para carregar variáveis de ambiente de um arquivo .env.
+from metricas import usuario_padrao, estimar_custo  # Métricas e custo estimado de cada requisição.
+from recuperacao import IndiceBM25  # Busca das mensagens relevantes em conversas longas.
+
+# Configuração do tokenizador para modelo GPT-4.
+nome_modelo = "gpt-4"  # Nome do modelo GPT-4.
+tokenizadores = {}  # Tokenizadores já carregados, por nome de codificação (GPT-3.5 e GPT-4 usam o mesmo).
+trava_tokenizadores = threading.Lock()  # Protege o registro dos tokenizadores carregados.
+
+# Retorna o tokenizador do modelo, carregando-o (e baixando as tabelas, na primeira vez) só quando necessário.
+def obter_tokenizador(modelo=nome_modelo):
+    import tiktoken  # Biblioteca para manipulação de tokens.
+    try:
+        nome_codificacao = tiktoken.encoding_name_for_model(modelo)  # Ex.: "cl100k_base".
+    except KeyError:
+        nome_codificacao = tiktoken.encoding_name_for_model(nome_modelo)  # Modelo desconhecido: usa o do GPT-4.
+    tokenizador = tokenizadores.get(nome_codificacao)
+    if tokenizador is None:
+        # Carrega fora da trava: um download lento não bloqueia os threads que usam outro tokenizador.
+        tokenizador = tiktoken.get_encoding(nome_codificacao)
+        with trava_tokenizadores:
+            tokenizador = tokenizadores.setdefault(nome_codificacao, tokenizador)  # Mantém o primeiro carregado.
+    return tokenizador
+
+# Carregando a chave API do arquivo .env para autenticar requisições à API da OpenAI.
+load_dotenv()  # Carrega as variáveis de ambiente do arquivo .env.
+chave_api = os.getenv('API_KEY')  # Define a chave da API a partir da variável de ambiente.
+link_api = os.getenv('API_URL', "https://api.openai.com/v1/chat/completions")  # URL da API (pode apontar para um servidor local de testes).
+timeout_conexao = float(os.getenv('API_TIMEOUT_CONEXAO', "10"))  # Tempo máximo (s) para abrir a conexão.
+timeout_leitura = float(os.getenv('API_TIMEOUT_LEITURA', "120"))  # Tempo máximo (s) sem receber dados da API.
+compressao = os.getenv('API_COMPRESSAO', "1") != "0"  # Pede respostas comprimidas (gzip) à API.
+max_requisicoes_simultaneas = int(os.getenv('MAX_REQUISICOES_SIMULTANEAS', "3"))  # Perguntas respondidas ao mesmo tempo.
+limite_rpm = int(os.getenv('LIMITE_RPM', "0"))  # Requisições por minuto (0 = só o que a API informa nos cabeçalhos).
+limite_tpm = int(os.getenv('LIMITE_TPM', "0"))  # Tokens por minuto (0 = só o que a API informa nos cabeçalhos).
+max_tentativas = int(os.getenv('API_MAX_TENTATIVAS', "5"))  # Tentativas de cada requisição antes de desistir.
+espera_base = float(os.getenv('API_ESPERA_BASE', "0.5"))  # Espera (s) da primeira nova tentativa; dobra a cada uma.
+espera_maxima = float(os.getenv('API_ESPERA_MAXIMA', "30"))  # Espera máxima (s) entre duas tentativas.
+status_temporarios = {408, 429, 500, 502, 503, 504}  # Respostas que valem uma nova tentativa.
+
+# Converte as durações dos cabeçalhos de limite ("20ms", "1.5s", "6m0s") para segundos.
+def ler_duracao(texto):
+    unidades = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+    partes = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", texto or "")
+    if not partes:
+        try:
+            return float(texto)  # Só o número, em segundos.
+        except (TypeError, ValueError):
+            return None
+    return sum(float(valor) * unidades[unidade] for valor, unidade in partes)
+
+# Controla o ritmo das requisições de uma chave da API, compartilhado por todas elas.
+# Acompanha o que sobra do limite de requisições e de tokens por minuto (informado pela API nos
+# cabeçalhos x-ratelimit-*, ou configurado em LIMITE_RPM/LIMITE_TPM) e faz cada requisição
+# esperar a sua vez antes de ser enviada, em vez de deixá-la receber um 429.
+class LimitadorTaxa:
+    def __init__(self, limite_rpm=limite_rpm, limite_tpm=limite_tpm, janela=60.0):
+        self.limite_rpm = limite_rpm
+        self.limite_tpm = limite_tpm
+        self.janela = janela  # Janela (s) dos limites configurados.
+        self.enviadas = deque()  # (instante, tokens) das requisições enviadas dentro da janela.
+        self.restantes = {"requests": None, "tokens": None}  # O que a API disse que sobra (None = desconhecido).
+        self.limites = {"requests": None, "tokens": None}  # Limite cheio informado pela API (x-ratelimit-limit-*).
+        self.renovacao = {"requests": 0.0, "tokens": 0.0}  # Quando o que sobra volta a ser o limite cheio.
+        self.renovacao_estimada = {"requests": False, "tokens": False}  # Renovação estimada pela janela, sem cabeçalho.
+        self.pausa_ate = 0.0  # Depois de um 429, ninguém envia antes deste instante.
+        self.reservados = {"requests": 0, "tokens": 0}  # Total já reservado.
+        self.concluidos = {"requests": 0, "tokens": 0}  # Total reservado por requisições que já tiveram resposta (ou desistiram).
+        self.respondida = False  # Se alguma requisição já teve resposta (até lá, o que sobra é desconhecido).
+        self.condicao = threading.Condition()
+
+    # Quanto tempo falta para uma requisição com esses tokens poder ser enviada (0 = pode agora).
+    # Deve ser chamado com a condição já adquirida.
+    def tempo_ate_liberar(self, tokens, agora):
+        esperas = [self.pausa_ate - agora]
+        if not self.respondida and self.reservados["requests"] > self.concluidos["requests"] and self.enviadas:
+            # Uma requisição por vez até a primeira resposta dizer quanto sobra (atualizar() acorda as outras).
+            esperas.append(self.enviadas[-1][0] + self.janela - agora)
+        for tipo, necessario in (("requests", 1), ("tokens", tokens)):
+            if self.restantes[tipo] is not None and agora >= self.renovacao[tipo]:
+                self.renovar(tipo, agora)
+            if self.restantes[tipo] is not None and self.restantes[tipo] < necessario:
+                esperas.append(self.renovacao[tipo] - agora)
+        while self.enviadas and agora - self.enviadas[0][0] >= self.janela:
+            self.enviadas.popleft()
+        if self.limite_rpm and len(self.enviadas) >= self.limite_rpm:
+            esperas.append(self.enviadas[-self.limite_rpm][0] + self.janela - agora)
+        usados = sum(t for _, t in self.enviadas)
+        if self.limite_tpm and self.enviadas and usados + tokens > self.limite_tpm:
+            excesso = usados + tokens - self.limite_tpm  # Tokens que precisam sair da janela primeiro.
+            liberados = 0
+            for instante, t in self.enviadas:
+                liberados += t
+                if liberados >= excesso:
+                    esperas.append(instante + self.janela - agora)
+                    break
+            else:
+                esperas.append(self.enviadas[-1][0] + self.janela - agora)  # Maior que o limite: espera a janela esvaziar.
+        return max(esperas + [0.0])
+
+    # O limite já renovou: volta ao limite cheio, menos o que está reservado por requisições ainda
+    # sem resposta (elas contam na janela nova). Até o próximo cabeçalho, a renovação seguinte é
+    # estimada pela janela. Sem o cabeçalho do limite cheio, o que sobra volta a ser desconhecido.
+    def renovar(self, tipo, agora):
+        if self.limites[tipo] is None:
+            self.restantes[tipo] = None
+            return
+        self.restantes[tipo] = self.limites[tipo] - (self.reservados[tipo] - self.concluidos[tipo])
+        self.renovacao[tipo] = agora + self.janela
+        self.renovacao_estimada[tipo] = True
+
+    # Espera a vez da requisição e reserva a parte dela nos limites. Retorna a marca da reserva,
+    # que deve ser passada a atualizar() junto com os cabeçalhos da resposta, ou a liberar() se a
+    # requisição não teve resposta (None se cancelada antes de reservar).
+    def reservar(self, tokens, cancelado=lambda: False):
+        with self.condicao:
+            while not cancelado():
+                agora = time.monotonic()
+                espera = self.tempo_ate_liberar(tokens, agora)
+                if espera <= 0:
+                    self.enviadas.append((agora, tokens))
+                    marca = {"concluidos": dict(self.concluidos), "reserva": tokens}  # O que já tinha resposta no envio.
+                    for tipo, usados in (("requests", 1), ("tokens", tokens)):
+                        self.reservados[tipo] += usados
+                        if self.restantes[tipo] is not None:
+                            self.restantes[tipo] -= usados
+                    self.condicao.notify()  # Passa a vez para a próxima, que confere o que sobrou.
+                    return marca
+                self.condicao.wait(espera)  # Também acorda com um novo cabeçalho, a vez de outra ou um cancelamento.
+            self.condicao.notify()  # Cancelada: não segura a vez das outras.
+        return None
+
+    # Conta a reserva da marca como concluída (uma vez só). Deve ser chamado com a condição adquirida.
+    def concluir(self, marca):
+        tokens = marca.pop("reserva", None)
+        if tokens is not None:
+            self.concluidos["requests"] += 1
+            self.concluidos["tokens"] += tokens
+        return tokens
+
+    # Requisição que terminou sem resposta da API (ex.: conexão recusada): deixa de contar como em andamento.
+    def liberar(self, marca):
+        with self.condicao:
+            self.concluir(marca)
+            self.condicao.notify()
+
+    # Atualiza o que sobra dos limites com os cabeçalhos de uma resposta da API. As respostas chegam
+    # fora da ordem em que a API contou as requisições: o cabeçalho só inclui com certeza as que já
+    # tinham resposta quando esta foi enviada. As outras reservadas até agora são descontadas, o que
+    # deixa a estimativa sempre abaixo do que de fato sobra; entre ela e a atual, vale a maior, e a
+    # renovação fica para o instante mais tardio informado. Sem nenhuma dessas incertas, o cabeçalho
+    # é exato e substitui a estimativa (que pode ter descontado tokens a mais).
+    def atualizar(self, cabecalhos, marca):
+        with self.condicao:
+            agora = time.monotonic()
+            tokens = self.concluir(marca)
+            if tokens is None:
+                return  # Marca já usada.
+            proprios = {"requests": 1, "tokens": tokens}
+            self.respondida = True
+            for tipo in ("requests", "tokens"):
+                try:
+                    restante = int(cabecalhos[f"x-ratelimit-remaining-{tipo}"])
+                except (KeyError, ValueError):
+                    continue
+                try:
+                    self.limites[tipo] = int(cabecalhos[f"x-ratelimit-limit-{tipo}"])
+                except (KeyError, ValueError):
+                    pass
+                incertos = self.reservados[tipo] - marca["concluidos"][tipo] - proprios[tipo]
+                restante -= incertos
+                renovacao = ler_duracao(cabecalhos.get(f"x-ratelimit-reset-{tipo}"))
+                renovacao = agora + (renovacao if renovacao is not None else self.janela)
+                if incertos and self.restantes[tipo] is not None and not self.renovacao_estimada[tipo]:
+                    renovacao = max(renovacao, self.renovacao[tipo])  # O limite só fica cheio quando a última requisição contada sai da janela.
+                self.renovacao[tipo] = renovacao
+                self.renovacao_estimada[tipo] = False
+                if incertos and self.restantes[tipo] is not None and restante < self.restantes[tipo]:
+                    continue  # A estimativa atual já é melhor.
+                self.restantes[tipo] = restante
+            self.condicao.notify()  # Acorda uma requisição por vez; cada uma passa a vez depois de reservar.
+
+    # Faz todas as requisições esperarem (ex.: depois de um 429 com retry-after).
+    def pausar(self, segundos):
+        with self.condicao:
+            self.pausa_ate = max(self.pausa_ate, time.monotonic() + segundos)
+
+    # Acorda quem está esperando (ex.: para uma requisição cancelada desistir na hora).
+    def acordar(self):
+        with self.condicao:
+            self.condicao.notify_all()
+
+medicao_conexao = threading.local()  # Tempo de abertura da última conexão, separado por thread.
+pools_medidos = None  # Classes de pool do urllib3 que medem a abertura das conexões (criadas no primeiro uso).
+
+# Cria as classes de pool cujas conexões guardam em medicao_conexao quanto demoraram para abrir
+# (TCP e, no HTTPS, o handshake TLS). Conexões reaproveitadas do pool não passam por aqui.
+def obter_pools_medidos():
+    global pools_medidos
+    if pools_medidos is None:
+        from urllib3.connection import HTTPConnection, HTTPSConnection
+        from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+        def medida(classe):
+            class ConexaoMedida(classe):
+                def connect(self):
+                    inicio = time.perf_counter()
+                    super().connect()
+                    medicao_conexao.tempo = time.perf_counter() - inicio
+            return ConexaoMedida
+
+        class PoolHTTP(HTTPConnectionPool):
+            ConnectionCls = medida(HTTPConnection)
+
+        class PoolHTTPS(HTTPSConnectionPool):
+            ConnectionCls = medida(HTTPSConnection)
+
+        pools_medidos = {"http": PoolHTTP, "https": PoolHTTPS}
+    return pools_medidos
+
+# Cliente HTTP compartilhado: mantém as conexões abertas (keep-alive) e reaproveita-as entre as mensagens.
+class ClienteHTTP:
+    def __init__(self, chave_api, link=link_api, timeout_conexao=timeout_conexao, timeout_leitura=timeout_leitura,
+                 compressao=compressao, tamanho_pool=10, limitador=None):
+        self.link = link  # URL da API.
+        self.limitador = limitador if limitador is not None else LimitadorTaxa()  # Ritmo compartilhado por todas as requisições.
+        self.timeout = (timeout_conexao, timeout_leitura)  # Timeouts de conexão e de leitura.
+        import requests  # Biblioteca para fazer requisições HTTP.
+        from requests.adapters import HTTPAdapter  # Adaptador com pool de conexões reutilizáveis.
+        self.sessao = requests.Session()  # Sessão que guarda o pool de conexões.
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=tamanho_pool)  # Pool com até tamanho_pool conexões simultâneas.
+        adaptador.poolmanager.pool_classes_by_scheme = obter_pools_medidos()  # Mede a abertura de cada conexão nova.
+        self.sessao.mount("https://", adaptador)
+        self.sessao.mount("http://", adaptador)
+        self.sessao.headers.update({  # Cabeçalhos montados uma única vez e enviados em todas as requisições.
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {chave_api}",
+            "Accept-Encoding": "gzip, deflate" if compressao else "identity",
+            "Connection": "keep-alive"
+        })
+
+    # Envia os dados para a API reaproveitando uma conexão do pool. A resposta leva junto o tempo
+    # de abertura da conexão (None se ela foi reaproveitada) e o tempo até chegarem os cabeçalhos.
+    def post(self, dados, stream=False):
+        medicao_conexao.tempo = None
+        inicio = time.perf_counter()
+        resposta = self.sessao.post(self.link, json=dados, stream=stream, timeout=self.timeout)
+        resposta.tempo_cabecalhos = time.perf_counter() - inicio
+        resposta.tempo_conexao = medicao_conexao.tempo
+        return resposta
+
+    # Interrompe uma resposta em andamento a partir de outro thread. Fechar a resposta não
+    # desbloqueia uma leitura parada no socket, então o socket é desligado (shutdown) antes.
+    def interromper(self, resposta):
+        conexao = getattr(resposta.raw, "_connection", None)  # Conexão do urllib3 presa à resposta.
+        sock = getattr(conexao, "sock", None)
+        if sock is None:  # Com "Connection: close" o socket fica só no arquivo de leitura do http.client.
+            arquivo = getattr(getattr(resposta.raw, "_fp", None), "fp", None)
+            sock = getattr(getattr(arquivo, "raw", None), "_sock", None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass  # Socket já fechado.
+        resposta.close()
+
+    # Fecha todas as conexões do pool.
+    def fechar(self):
+        self.sessao.close()
+
+# Configuração do cache local de respostas.
+cache_ativo = os.getenv('CACHE_ATIVO', "1") != "0"  # Liga ou desliga o cache.
+pasta_cache = os.getenv('CACHE_DIR', os.path.join(os.path.expanduser("~"), ".gptzinho", "cache"))  # Onde as respostas ficam guardadas.
+cache_max_mb = float(os.getenv('CACHE_MAX_MB', "50"))  # Tamanho máximo do cache em disco.
+cache_validade = float(os.getenv('CACHE_TTL', "0"))  # Validade (s) de cada resposta; 0 = sem expiração.
+cache_temperatura_alta = os.getenv('CACHE_TEMPERATURA_ALTA', "0") == "1"  # Usa o cache também com temperatura acima de 0.
+
+# Cache de respostas em disco, endereçado pelo conteúdo da requisição (modelo, mensagens e temperatura).
+# Cada resposta fica em um arquivo <hash>.json; quando o cache passa do tamanho máximo,
+# as respostas usadas há mais tempo são apagadas (LRU).
+class CacheRespostas:
+    def __init__(self, pasta=pasta_cache, max_mb=cache_max_mb, validade=cache_validade,
+                 temperatura_alta=cache_temperatura_alta, ativo=cache_ativo):
+        self.pasta = pasta  # Pasta dos arquivos do cache.
+        self.max_bytes = int(max_mb * 1024 * 1024)  # Tamanho máximo em bytes.
+        self.validade = validade  # Validade de cada resposta em segundos.
+        self.temperatura_alta = temperatura_alta  # Permite o cache com temperatura acima de 0.
+        self.ativo = ativo
+        self.indice = None  # Tamanho e último uso de cada arquivo; montado no primeiro acesso.
+        self.total_bytes = 0
+        self.acertos = 0  # Respostas encontradas no cache.
+        self.falhas = 0  # Respostas que precisaram ir à API.
+        self.trava = threading.Lock()  # Vários Workers podem usar o cache ao mesmo tempo.
+
+    # Respostas com temperatura acima de 0 variam a cada chamada; só entram no cache se o usuário quiser.
+    def aplicavel(self, temperatura):
+        return self.ativo and (round(temperatura, 2) == 0 or self.temperatura_alta)
+
+    def chave(self, modelo, mensagens, temperatura):
+        conteudo = json.dumps({"model": modelo, "messages": mensagens, "temperature": round(temperatura, 2)},
+                              sort_keys=True, ensure_ascii=False)  # Serialização estável da requisição.
+        return hashlib.sha256(conteudo.encode("utf-8")).hexdigest()
+
+    def caminho(self, chave):
+        return os.path.join(self.pasta, f"{chave}.json")
+
+    # Lê da pasta o tamanho e a data de uso de cada resposta guardada.
+    def carregar_indice(self):
+        if self.indice is not None:
+            return
+        self.indice = {}
+        os.makedirs(self.pasta, exist_ok=True)
+        for nome in os.listdir(self.pasta):
+            if nome.endswith(".json"):
+                info = os.stat(os.path.join(self.pasta, nome))
+                self.indice[nome[:-len(".json")]] = (info.st_size, info.st_mtime)
+                self.total_bytes += info.st_size
+
+    def remover(self, chave):
+        tamanho, _ = self.indice.pop(chave)
+        self.total_bytes -= tamanho
+        try:
+            os.remove(self.caminho(chave))
+        except OSError:
+            pass  # Arquivo já apagado por fora.
+
+    def obter(self, chave):
+        with self.trava:
+            self.carregar_indice()
+            if chave not in self.indice:
+                self.falhas += 1
+                return None
+            tamanho, usado_em = self.indice[chave]
+            agora = time.time()
+            if self.validade and agora - usado_em > self.validade:  # Resposta vencida.
+                self.remover(chave)
+                self.falhas += 1
+                return None
+            try:
+                with open(self.caminho(chave), encoding="utf-8") as arquivo:
+                    resposta = json.load(arquivo)
+            except (OSError, ValueError):  # Arquivo apagado ou corrompido.
+                self.remover(chave)
+                self.falhas += 1
+                return None
+            if not self.validade:  # Sem validade, a data do arquivo marca o último uso (LRU).
+                os.utime(self.caminho(chave), (agora, agora))
+                self.indice[chave] = (tamanho, agora)
+            self.acertos += 1
+            return resposta
+
+    def guardar(self, chave, resposta):
+        conteudo = json.dumps(resposta, ensure_ascii=False).encode("utf-8")
+        with self.trava:
+            self.carregar_indice()
+            if chave in self.indice:
+                self.remover(chave)
+            temporario = self.caminho(chave) + ".tmp"
+            with open(temporario, "wb") as arquivo:
+                arquivo.write(conteudo)
+            os.replace(temporario, self.caminho(chave))  # Troca atômica: nunca deixa um arquivo pela metade.
+            self.indice[chave] = (len(conteudo), time.time())
+            self.total_bytes += len(conteudo)
+            while self.total_bytes > self.max_bytes and len(self.indice) > 1:  # Apaga as menos usadas até caber.
+                mais_antiga = min(self.indice, key=lambda c: self.indice[c][1])
+                self.remover(mais_antiga)
+
+    def estatisticas(self):
+        with self.trava:
+            consultas = self.acertos + self.falhas
+            return {
+                "acertos": self.acertos,
+                "falhas": self.falhas,
+                "taxa_acerto": self.acertos / consultas if consultas else 0.0,
+                "respostas": len(self.indice or {}),
+                "bytes": self.total_bytes
+            }
+
+# Tamanho da janela de contexto (em tokens) de cada modelo.
+limites_contexto = {
+    "gpt-3.5-turbo-16k": 16385,
+    "gpt-4-0613": 8192,
+    "gpt-4": 8192
+}
+
+# Configuração da seleção do histórico em conversas longas.
+contexto_recuperacao = os.getenv('CONTEXTO_RECUPERACAO', "1") != "0"  # Envia só os turnos relevantes quando o histórico é grande.
+contexto_orcamento = int(os.getenv('CONTEXTO_ORCAMENTO_TOKENS', "3000"))  # Tokens do histórico enviados nesse caso.
+
+# Gerencia o histórico da conversa, guardando a contagem de tokens de cada mensagem
+# e montando a lista enviada à API de forma que caiba no contexto do modelo.
+# Quando o histórico passa do orçamento, em vez das mensagens mais novas vão os turnos
+# mais relevantes para a pergunta (busca BM25, indexada a cada mensagem adicionada)
+# junto com as mensagens mais recentes.
+class GerenciadorContexto:
+    tokens_por_mensagem = 4  # Tokens extras que a API cobra por mensagem (papel e separadores).
+    tokens_resposta_inicio = 3  # Tokens que iniciam a resposta do assistente.
+
+    def __init__(self, turnos_recentes=4, max_tokens_resposta=4000, min_tokens_resposta=1000,
+                 recuperacao=contexto_recuperacao, orcamento_historico=contexto_orcamento):
+        self.mensagens = []  # Histórico completo da conversa.
+        self.tokens = []  # Contagem de tokens de cada mensagem (mesma ordem de self.mensagens).
+        self.turnos_recentes = turnos_recentes  # Quantidade de mensagens recentes sempre mantidas.
+        self.max_tokens_resposta = max_tokens_resposta  # Limite máximo de tokens pedidos para a resposta.
+        self.min_tokens_resposta = min_tokens_resposta  # Espaço mínimo reservado para a resposta.
+        self.recuperacao = recuperacao  # Seleciona os turnos relevantes em conversas longas.
+        self.orcamento_historico = orcamento_historico  # Tokens do histórico enviados em conversas longas.
+        self.indice = IndiceBM25()  # Índice das mensagens, por id (posição + self.base).
+        self.base = 0  # Id da primeira mensagem de self.mensagens; diminui quando entram mensagens anteriores.
+        self.trava = threading.Lock()  # A contagem pode ser feita tanto pela interface quanto pelos Workers.
+
+    # Adiciona a mensagem ao histórico; sem a contagem de tokens (ex.: vinda do banco), ela é feita na próxima montagem.
+    def adicionar(self, mensagem, tokens=None):
+        with self.trava:
+            self.mensagens.append(mensagem)
+            if tokens is not None and len(self.tokens) == len(self.mensagens) - 1:
+                self.tokens.append(tokens)  # Contagem já conhecida: não precisa codificar de novo.
+            if self.recuperacao and mensagem['role'] != "system":  # Mensagens de sistema sempre vão; não precisam ser buscadas.
+                self.indice.adicionar(self.base + len(self.mensagens) - 1, mensagem['content'])
+
+    # Coloca mensagens mais antigas (ex.: uma página carregada do banco) no início do histórico.
+    def inserir_anteriores(self, mensagens, tokens):
+        with self.trava:
+            tokenizador = obter_tokenizador() if None in tokens else None
+            tokens = [t if t is not None else len(tokenizador.encode(m['content'], disallowed_special=())) + self.tokens_por_mensagem
+                      for m, t in zip(mensagens, tokens)]
+            self.mensagens[0:0] = mensagens
+            self.tokens[0:0] = tokens
+            self.base -= len(mensagens)
+            for posicao, mensagem in enumerate(mensagens):
+                if self.recuperacao and mensagem['role'] != "system":
+                    self.indice.adicionar(self.base + posicao, mensagem['content'])
+
+    def limpar(self):
+        with self.trava:
+            self.mensagens.clear()
+            self.tokens.clear()
+            self.indice.limpar()
+            self.base = 0
+
+    # Conta os tokens das mensagens que ainda não têm contagem guardada.
+    def contar_pendentes(self):
+        with self.trava:
+            tokenizador = obter_tokenizador()
+            for mensagem in self.mensagens[len(self.tokens):]:
+                self.tokens.append(len(tokenizador.encode(mensagem['content'], disallowed_special=())) + self.tokens_por_mensagem)
+
+    # Total de tokens do histórico completo.
+    def total_tokens(self):
+        self.contar_pendentes()
+        return sum(self.tokens)
+
+    # Posições da pergunta e da resposta do turno da mensagem i (só a mensagem, se ela estiver sozinha).
+    def turno(self, todas, i, quantidade):
+        if todas[i]['role'] == "user" and i + 1 < quantidade and todas[i + 1]['role'] == "assistant":
+            return [i, i + 1]
+        if todas[i]['role'] == "assistant" and i > 0 and todas[i - 1]['role'] == "user":
+            return [i - 1, i]
+        return [i]
+
+    # Monta as mensagens que cabem no contexto do modelo e calcula o max_tokens da resposta.
+    # As mensagens de extras (ex.: a pergunta que está sendo enviada) entram sempre, depois do histórico.
+    # A consulta usada para buscar os turnos relevantes é o texto de extras, a menos que outra seja passada
+    # (ex.: o texto ainda sendo digitado, para a estimativa do contador).
+    def montar(self, modelo, extras=(), consulta=None):
+        self.contar_pendentes()
+        tokenizador = obter_tokenizador()
+        quantidade = len(self.tokens)  # Histórico já contado no momento da montagem.
+        todas = self.mensagens[:quantidade] + list(extras)
+        tokens = self.tokens[:quantidade] + [len(tokenizador.encode(m['content'], disallowed_special=())) + self.tokens_por_mensagem for m in extras]
+        limite = limites_contexto.get(modelo, 4096)  # Tamanho do contexto do modelo.
+        orcamento = limite - self.min_tokens_resposta - self.tokens_resposta_inicio  # Espaço disponível para o prompt.
+        total = len(todas)
+        fixas = {i for i, m in enumerate(todas) if m['role'] == "system"}  # Mensagens de sistema ficam sempre.
+        fixas.update(range(quantidade, total))  # Assim como as mensagens de extras (a pergunta enviada).
+        i = quantidade - 1
+        recentes = max(self.turnos_recentes - len(extras), 0)  # Mensagens recentes do histórico que também ficam sempre.
+        while i >= 0 and quantidade - 1 - i < recentes:
+            turno = self.turno(todas, i, quantidade)  # Turnos inteiros: uma resposta não fica sem a pergunta.
+            fixas.update(turno)
+            i = min(turno) - 1
+        usados = sum(tokens[i] for i in fixas)
+        escolhidas = set(fixas)
+        if consulta is None:
+            consulta = " ".join(m['content'] for m in extras)
+        recuperar = self.recuperacao and consulta.strip() and sum(tokens[:quantidade]) > self.orcamento_historico
+        if recuperar:  # Histórico grande: entram só os turnos mais relevantes para a pergunta.
+            orcamento = min(orcamento, self.orcamento_historico + sum(tokens[quantidade:]))
+            with self.trava:
+                encontrados = self.indice.buscar(consulta, limite=50)
+                base = self.base
+            for documento, _ in encontrados:
+                i = documento - base
+                if not 0 <= i < quantidade:
+                    continue  # Mensagem adicionada depois da contagem.
+                novas = [j for j in self.turno(todas, i, quantidade) if j not in escolhidas]
+                custo = sum(tokens[j] for j in novas)
+                if novas and usados + custo <= orcamento:
+                    escolhidas.update(novas)
+                    usados += custo
+        else:
+            for i in range(total - 1, -1, -1):  # Preenche o restante com as mensagens mais novas primeiro.
+                if i in escolhidas:
+                    continue
+                if usados + tokens[i] > orcamento:
+                    break  # As mensagens mais antigas a partir daqui são descartadas.
+                escolhidas.add(i)
+                usados += tokens[i]
+        mensagens = [todas[i] for i in sorted(escolhidas)]
+        omitidas = total - len(escolhidas)
+        if omitidas:  # Avisa o modelo que parte da conversa foi omitida.
+            if recuperar:
+                aviso = {"role": "system", "content": f"({omitidas} mensagens anteriores foram omitidas; foram mantidas as mais relevantes para a pergunta.)"}
+            else:
+                aviso = {"role": "system", "content": f"({omitidas} mensagens anteriores foram omitidas por limite de contexto.)"}
+            primeira_omitida = min(set(range(total)) - escolhidas)
+            posicao = sum(1 for i in escolhidas if i < primeira_omitida)  # Entra no lugar das mensagens omitidas.
+            mensagens.insert(posicao, aviso)
+            usados += len(tokenizador.encode(aviso['content'])) + self.tokens_por_mensagem
+        tokens_prompt = usados + self.tokens_resposta_inicio
+        max_tokens = max(min(self.max_tokens_resposta, limite - tokens_prompt), 1)  # Usa o espaço que sobrou no contexto.
+        return mensagens, tokens_prompt, max_tokens
+
+# Uma requisição de chat completion: consulta o cache, envia à API (com ou sem streaming)
+# e pode ser cancelada de outro thread. Não depende do Qt; os trechos recebidos em
+# streaming são repassados pela função ao_receber_trecho. Com um RegistroMetricas,
+# cada execução é registrada com seus tempos, tokens e custo estimado.
+class Requisicao:
+    def __init__(self, cliente_http, cache, modelo, mensagens, temperatura, max_tokens, tokens_prompt,
+                 streaming=False, ao_receber_trecho=None, metricas=None, usuario=usuario_padrao, enfileirada_em=None):
+        self.cliente_http = cliente_http  # Cliente HTTP compartilhado.
+        self.cache = cache  # Cache de respostas (ou None para não usar).
+        self.modelo = modelo
+        self.mensagens = mensagens  # Histórico montado para esta requisição.
+        self.temperatura = temperatura
+        self.max_tokens = max_tokens  # Limite de tokens da resposta.
+        self.tokens_prompt = tokens_prompt  # Tamanho estimado do prompt.
+        self.streaming = streaming  # Recebe a resposta em partes.
+        self.ao_receber_trecho = ao_receber_trecho  # Chamada a cada trecho recebido no modo streaming.
+        self.cancelado = False  # Marcado por cancelar().
+        self.resposta_atual = None  # Resposta HTTP em andamento, fechada ao cancelar.
+        self.erro = None  # Descrição do erro, quando não há resposta.
+        self.metricas = metricas  # Registro das métricas (ou None para não registrar).
+        self.usuario = usuario  # Usuário a quem o custo é atribuído.
+        self.enfileirada_em = enfileirada_em if enfileirada_em is not None else time.perf_counter()  # Início da espera na fila.
+        self.inicio = None  # Início da execução (fim da espera na fila).
+        self.medicoes = {}  # Tempos e status medidos durante o envio.
+        self.tentativas = 0  # Quantas vezes a requisição foi enviada à API.
+        self.evento_cancelado = threading.Event()  # Interrompe a espera entre duas tentativas.
+
+    # Cancela a requisição; se a resposta já estiver chegando, fecha o socket para interromper a leitura.
+    def cancelar(self):
+        self.cancelado = True
+        self.evento_cancelado.set()
+        self.cliente_http.limitador.acordar()  # Desiste da vez, se estava esperando o limite de uso.
+        resposta = self.resposta_atual
+        if resposta is not None:
+            self.cliente_http.interromper(resposta)
+
+    # Prepara e envia a requisição, usando o cache quando possível, e registra as métricas.
+    # Retorna (resposta, contagem de tokens).
+    def executar(self):
+        self.inicio = time.perf_counter()
+        resposta_json, contagem_tokens = self.obter_resposta()
+        if self.metricas is not None:
+            self.metricas.registrar(self.registro(resposta_json))
+        return resposta_json, contagem_tokens
+
+    def obter_resposta(self):
+        dados = {  # Dados da requisição.
+            "model": self.modelo,
+            "messages": self.mensagens,
+            "temperature": self.temperatura,
+            "max_tokens": self.max_tokens
+        }
+        cache = self.cache
+        chave = None
+        if cache is not None and cache.aplicavel(self.temperatura):
+            chave = cache.chave(self.modelo, self.mensagens, self.temperatura)
+            resposta_json = cache.obter(chave)  # Procura a mesma requisição no cache.
+            if resposta_json is not None:
+                resposta_json["cache"] = True  # Marca a resposta para a interface.
+                self.medicoes["status"] = "cache"
+                return resposta_json, resposta_json.get('usage', {}).get('total_tokens', 0)
+        resposta_json, contagem_tokens = self.requisitar(dados, self.tokens_prompt)
+        if chave is not None and resposta_json is not None and not self.cancelado:
+            cache.guardar(chave, resposta_json)  # Guarda a resposta para as próximas vezes.
+        return resposta_json, contagem_tokens
+
+    # Envia a requisição à API pelo cliente HTTP compartilhado.
+    def requisitar(self, dados, tokens_prompt):
+        streaming = self.streaming  # Define se a resposta será recebida em partes.
+        if streaming:
+            dados["stream"] = True  # Pede a resposta como eventos SSE.
+            dados["stream_options"] = {"include_usage": True}  # Pede o uso de tokens no último evento.
+        limitador = self.cliente_http.limitador
+        tokens_estimados = tokens_prompt + self.max_tokens  # A API desconta do limite o prompt mais o max_tokens pedido.
+        while True:
+            inicio_espera = time.perf_counter()
+            marca = limitador.reservar(tokens_estimados, lambda: self.cancelado)  # Espera a vez dentro dos limites de uso.
+            self.medicoes["espera_limite"] = self.medicoes.get("espera_limite", 0.0) + time.perf_counter() - inicio_espera
+            if self.cancelado:
+                if marca is not None:
+                    limitador.liberar(marca)
+                self.erro = "Requisição cancelada"
+                return None, 0
+            try:
+                # O corpo é sempre lido aos poucos (stream=True no requests) para que cancelar() possa fechar a conexão.
+                self.tentativas += 1
+                resposta = self.cliente_http.post(dados, stream=True)  # Envia a requisição POST pelo cliente compartilhado.
+                self.resposta_atual = resposta
+                self.medicoes["status"] = resposta.status_code
+                self.medicoes["conexao"] = resposta.tempo_conexao
+                self.medicoes["ttfb"] = resposta.tempo_cabecalhos
+                limitador.atualizar(resposta.headers, marca)  # O que sobra dos limites de uso.
+                if self.cancelado:
+                    resposta.close()  # Cancelado enquanto esperava os cabeçalhos.
+                    self.erro = "Requisição cancelada"
+                    return None, 0
+                if resposta.status_code == 200:  # Verifica se a resposta é bem-sucedida.
+                    if streaming:
+                        return self.ler_streaming(resposta, tokens_prompt)  # Lê os eventos conforme chegam.
+                    resposta_json = resposta.json()  # Converte a resposta para JSON.
+                    if 'choices' in resposta_json and resposta_json['choices']:  # Verifica se há respostas válidas.
+                        contagem_tokens = resposta_json.get('usage', {}).get('total_tokens', 0)  # Obtém a contagem de tokens.
+                        return resposta_json, contagem_tokens  # Retorna a resposta e a contagem de tokens.
+                    else:
+                        self.erro = "Resposta da API não contém 'choices'"
+                        print(self.erro)  # Mensagem de erro.
+                        return None, 0
+                elif resposta.status_code in status_temporarios and self.tentativas < max_tentativas:
+                    espera = self.tempo_espera(resposta)
+                    resposta.close()  # Devolve a conexão ao pool.
+                    print(f"Erro na requisição: {resposta.status_code}; nova tentativa em {espera:.1f} s")
+                    if resposta.status_code == 429:
+                        limitador.pausar(espera)  # O limite é da chave: todas as requisições esperam.
+                    else:
+                        self.evento_cancelado.wait(espera)
+                    continue
+                else:
+                    self.erro = f"Erro na requisição: {resposta.status_code}"
+                    print(self.erro)  # Mensagem de erro.
+                    resposta.close()  # Devolve a conexão ao pool.
+                    return None, 0
+            except Exception as e:
+                limitador.liberar(marca)  # Sem resposta, a reserva não fica em andamento (nada muda se já houve).
+                if self.cancelado:  # cancelar() fechou a conexão no meio da leitura: não é um erro.
+                    self.erro = "Requisição cancelada"
+                    return None, 0
+                import requests  # Já carregado pelo cliente HTTP.
+                # Conexão recusada ou derrubada antes de qualquer trecho chegar: vale uma nova tentativa.
+                if (isinstance(e, requests.ConnectionError) and not self.cancelado and "primeiro_trecho" not in self.medicoes
+                        and self.tentativas < max_tentativas):
+                    espera = self.tempo_espera()
+                    print(f"Exceção ao fazer a solicitação: {e}; nova tentativa em {espera:.1f} s")
+                    self.evento_cancelado.wait(espera)
+                    continue
+                self.erro = f"Exceção ao fazer a solicitação: {e}"
+                print(self.erro)  # Mensagem de erro em caso de exceção.
+                return None, 0
+
+    # Tempo até a próxima tentativa: o que a API pediu (retry-after) ou um recuo exponencial com
+    # jitter, para que as requisições que falharam juntas não voltem todas ao mesmo tempo.
+    def tempo_espera(self, resposta=None):
+        cabecalhos = resposta.headers if resposta is not None else {}
+        if "retry-after-ms" in cabecalhos:
+            pedido = ler_duracao(cabecalhos["retry-after-ms"] + "ms")
+        else:
+            pedido = ler_duracao(cabecalhos.get("retry-after"))
+        if pedido is not None:
+            return pedido + random.uniform(0, espera_base)
+        return random.uniform(0, min(espera_maxima, espera_base * 2 ** self.tentativas))
+
+    # Lê a resposta em streaming (server-sent events), emitindo cada trecho assim que chega.
+    def ler_streaming(self, resposta, tokens_prompt):
+        trechos = []  # Partes do texto recebidas até agora.
+        uso = None  # Uso de tokens informado pela API no fim do streaming.
+        resposta.encoding = "utf-8"  # SSE é sempre UTF-8; sem charset no Content-Type, o requests usaria ISO-8859-1.
+        fim = False  # Já chegou o [DONE].
+        for linha in resposta.iter_lines(decode_unicode=True):  # Percorre os eventos linha a linha.
+            if fim or not linha or not linha.startswith("data:"):
+                continue  # Ignora linhas vazias, comentários do SSE e o que vier depois do fim.
+            conteudo = linha[len("data:"):].strip()  # Remove o prefixo do evento.
+            if conteudo == "[DONE]":
+                # Fim do streaming. O corpo continua sendo lido até o final (o terminador do chunked),
+                # senão a conexão não pode voltar ao pool e a próxima requisição abre outra.
+                fim = True
+                continue
+            evento = json.loads(conteudo)  # Decodifica o evento.
+            if evento.get('usage'):
+                uso = evento['usage']  # Guarda o uso de tokens enviado no último evento.
+            for escolha in evento.get('choices') or []:
+                trecho = escolha.get('delta', {}).get('content')  # Obtém o texto novo.
+                if trecho:
+                    if not trechos:
+                        self.medicoes["primeiro_trecho"] = time.perf_counter() - self.inicio
+                    trechos.append(trecho)
+                    if self.ao_receber_trecho is not None:
+                        self.ao_receber_trecho(trecho)  # Envia o trecho para quem pediu (ex.: a interface).
+        resposta.close()  # Libera a conexão.
+        if not trechos:
+            self.erro = "Resposta da API não contém 'choices'"
+            print(self.erro)  # Mensagem de erro.
+            return None, 0
+        texto = "".join(trechos)  # Junta a resposta completa.
+        if uso is None:  # Servidor não informou o uso: estima com o tokenizador.
+            tokens_resposta = len(obter_tokenizador(self.modelo).encode(texto, disallowed_special=()))
+            uso = {"prompt_tokens": tokens_prompt, "completion_tokens": tokens_resposta, "total_tokens": tokens_prompt + tokens_resposta}
+        resposta_json = {  # Monta a resposta no mesmo formato do modo sem streaming.
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": texto}, "finish_reason": "stop"}],
+            "usage": uso
+        }
+        return resposta_json, uso.get('total_tokens', 0)  # Retorna a resposta e a contagem de tokens.
+
+    # Monta o registro de métricas desta execução.
+    def registro(self, resposta_json):
+        def ms(segundos):
+            return round(segundos * 1000, 3) if segundos is not None else None
+        uso = (resposta_json or {}).get('usage', {})
+        em_cache = bool((resposta_json or {}).get('cache'))
+        tokens_prompt = uso.get('prompt_tokens', 0)
+        tokens_resposta = uso.get('completion_tokens', 0)
+        return {
+            "data": time.time(),
+            "usuario": self.usuario,
+            "modelo": self.modelo,
+            "streaming": self.streaming,
+            "status": self.medicoes.get("status"),  # Status HTTP, "cache" ou None (falha antes da resposta).
+            "cache": em_cache,
+            "cancelado": self.cancelado,
+            "erro": self.erro if resposta_json is None and not self.cancelado else None,  # Cancelamentos não contam como erro.
+            "tentativas": self.tentativas,
+            "espera_fila_ms": ms(self.inicio - self.enfileirada_em),
+            "espera_limite_ms": ms(self.medicoes.get("espera_limite")),  # Tempo esperando os limites de uso e novas tentativas por 429.
+            "conexao_ms": ms(self.medicoes.get("conexao")),  # None quando a conexão foi reaproveitada do pool.
+            "ttfb_ms": ms(self.medicoes.get("ttfb")),
+            "primeiro_trecho_ms": ms(self.medicoes.get("primeiro_trecho")),
+            "latencia_ms": ms(time.perf_counter() - self.inicio),
+            "tokens_prompt": tokens_prompt,
+            "tokens_resposta": tokens_resposta,
+            "custo_usd": 0.0 if em_cache else round(estimar_custo(self.modelo, tokens_prompt, tokens_resposta), 6)
+        }
@@ -0,0 +1,72 @@
+# Índice de busca sobre as mensagens da conversa (BM25), sem dependências além da biblioteca padrão.
+# Cada mensagem é indexada assim que entra no histórico, em tempo proporcional ao tamanho dela,
+# e a busca devolve as mensagens mais parecidas com a pergunta nova. É usado por
+# GerenciadorContexto para enviar à API só as partes relevantes de conversas longas.
+import math  # Biblioteca para o cálculo do IDF.
+import re  # Biblioteca para separar as palavras.
+import heapq  # Biblioteca para escolher as mensagens de maior pontuação sem ordenar todas.
+import unicodedata  # Biblioteca para remover os acentos.
+
+# Palavras muito comuns, que não ajudam a achar mensagens relevantes.
+palavras_ignoradas = set("""
+a o e é de da do das dos em no na nos nas um uma uns umas para por com sem que se não mais mas ou
+como ao aos à às eu tu ele ela nós vós eles elas me te lhe nos vos isso isto esse essa este esta
+meu minha seu sua qual quais quando onde já também muito pode ser foi são está estou tem ter há
+the of and to in is it that for on with as are be this was or an by at from not what how can you
+""".split())
+
+acentos = re.compile(r"[\u0300-\u036f]")  # Marcas de acento separadas das letras pela normalização NFKD.
+
+def remover_acentos(texto):
+    return acentos.sub("", unicodedata.normalize("NFKD", texto))
+
+# Separa o texto em termos: palavras em minúsculas, sem acentos e sem as palavras comuns.
+def termos(texto):
+    return [p for p in re.findall(r"\w+", remover_acentos(texto.lower())) if p not in palavras_ignoradas and len(p) > 1]
+
+class IndiceBM25:
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1  # Saturação da frequência de cada termo.
+        self.b = b  # Peso da normalização pelo tamanho da mensagem.
+        self.postagens = {}  # Termo -> {documento: frequência do termo no documento}.
+        self.tamanhos = {}  # Quantidade de termos de cada documento.
+        self.total_termos = 0
+
+    def __len__(self):
+        return len(self.tamanhos)
+
+    # Indexa um documento (ex.: uma mensagem); o custo depende só do tamanho dele.
+    def adicionar(self, documento, texto):
+        lista = termos(texto)
+        for termo in lista:
+            frequencias = self.postagens.setdefault(termo, {})
+            frequencias[documento] = frequencias.get(documento, 0) + 1
+        self.tamanhos[documento] = len(lista)
+        self.total_termos += len(lista)
+
+    # Os documentos mais parecidos com o texto, como [(documento, pontuação), ...] em ordem decrescente.
+    # Só o começo e o fim de um texto longo e, deles, os max_termos termos mais raros (os de maior IDF)
+    # entram na busca, então um texto enorme (ex.: um arquivo colado na entrada) custa o mesmo que uma pergunta curta.
+    def buscar(self, texto, limite=20, ignorar=(), max_termos=32, max_caracteres=8000):
+        if not self.tamanhos:
+            return []
+        if len(texto) > max_caracteres:
+            texto = texto[:max_caracteres // 2] + " " + texto[-(max_caracteres // 2):]
+        quantidade = len(self.tamanhos)
+        tamanho_medio = self.total_termos / quantidade or 1
+        pontuacoes = {}
+        presentes = [termo for termo in set(termos(texto)) if termo in self.postagens]
+        for termo in heapq.nsmallest(max_termos, presentes, key=lambda termo: len(self.postagens[termo])):
+            frequencias = self.postagens[termo]
+            idf = math.log(1 + (quantidade - len(frequencias) + 0.5) / (len(frequencias) + 0.5))
+            for documento, frequencia in frequencias.items():
+                normalizacao = self.k1 * (1 - self.b + self.b * self.tamanhos[documento] / tamanho_medio)
+                pontuacoes[documento] = pontuacoes.get(documento, 0.0) + idf * frequencia * (self.k1 + 1) / (frequencia + normalizacao)
+        for documento in ignorar:
+            pontuacoes.pop(documento, None)
+        return heapq.nlargest(limite, pontuacoes.items(), key=lambda item: item[1])
+
+    def limpar(self):
+        self.postagens.clear()
+        self.tamanhos.clear()
+        self.total_termos = 0